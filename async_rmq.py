@@ -5,9 +5,12 @@ from typing import Optional
 from base.events import RecommendationsEvent, State
 from base.rabbitmq_client import RabbitMqClient
 from recommendations import Recommendations
+from base.tmdbclient import close_session
 import traceback
 from aio_pika import IncomingMessage
 from aio_pika.robust_queue import RobustQueueIterator
+from prometheus_client import start_http_server
+from env_config import Config
 
 
 class AsyncRMQ:
@@ -16,8 +19,20 @@ class AsyncRMQ:
         self.rabbitmq_client = RabbitMqClient()
         self.recommendations = Recommendations()
         self.iterator: Optional[RobustQueueIterator] = None
+        # Process as many messages at once as there are calculation workers
+        self.concurrency = max(1, self.recommendations.calc_executor.workers)
+        self.slots: Optional[asyncio.Semaphore] = None
+        self.tasks = set()
+
+    async def run(self):
+        try:
+            await self.consume_reccs_events()
+        finally:
+            await close_session()
 
     async def consume_reccs_events(self):
+        self.slots = asyncio.Semaphore(self.concurrency)
+        await self.recommendations.mongo_client.ensure_indexes()
         while True:
             try:
                 routing_key = RecommendationsEvent.routing_key()
@@ -26,47 +41,17 @@ class AsyncRMQ:
                                                                                auto_delete=False)
                 if error:
                     print(f"Error {error} attempting to declare the queue for routing key: {routing_key}")
-                    recommendations_event.state = State.fail
                     raise error
 
                 await self.rabbitmq_client.refresh_channel()
+                await self.rabbitmq_client.set_prefetch(self.concurrency)
                 async with events_queue.iterator() as iterator:
                     self.iterator = iterator
                     async for message in iterator:
-                        message: IncomingMessage = message
-                        async with message.process():
-                            try:
-                                print("MESSAGE")
-                                print(message)
-                                event_dict: dict = json.loads(message.body, object_hook=json_util.object_hook)
-                                recommendations_event: RecommendationsEvent = RecommendationsEvent.reconstruct(event_dict)
-                                print(
-                                    f"Consumed RecommendationsEvent for user: {recommendations_event.user_id}")
-                                recommendations_event.state = State.in_progress
-                            except Exception as err:
-                                print(f"Error attempting to ingest message from RMQ -> {err}")
-                                raise err
-                            new_reccs, error = await self.recommendations.process_recommendations(user_id=recommendations_event.user_id)
-                            if error:
-                                print(f"Error {error} calculating reccs for user: {recommendations_event.user_id}")
-                                recommendations_event.state = State.fail
-                            else:
-                                print(f"Successfully calculated Recommendations for user: {recommendations_event.user_id}")
-                                recommendations_event.state = State.ok
-                                recommendations_event.reccomendations = new_reccs
-
-                            if message.correlation_id:
-                                print(f"Returning RecommendationsEvent for {recommendations_event.user_id}")
-
-                                exception_new = await self.rabbitmq_client.publish_new(message=recommendations_event.deconstruct(),
-                                                                                    correlation_id=message.correlation_id,
-                                                                                    routing_key=message.reply_to, default=True)
-                                if exception_new:
-                                    print(f"Error {exception_new} when attempting to send recommendations event back to the reply queue")
-                                else:
-                                    print(f"Published RecommendationsEvent back to it's source")
-                            else:
-                                print(f"No correlation ID. Not publishing back to reply queue.")
+                        await self.slots.acquire()
+                        task = asyncio.create_task(self.process_message(message))
+                        self.tasks.add(task)
+                        task.add_done_callback(self.message_done)
 
             except Exception as error:
                 print(
@@ -74,13 +59,60 @@ class AsyncRMQ:
                 print(traceback.format_exc())
                 await asyncio.sleep(30)
 
+    def message_done(self, task: asyncio.Task):
+        self.tasks.discard(task)
+        self.slots.release()
+        if not task.cancelled() and task.exception():
+            print(f"Error processing RecommendationsEvent: {task.exception()}")
+
+    async def process_message(self, message: IncomingMessage):
+        async with message.process():
+            try:
+                print("MESSAGE")
+                print(message)
+                event_dict: dict = json.loads(message.body, object_hook=json_util.object_hook)
+                recommendations_event: RecommendationsEvent = RecommendationsEvent.reconstruct(event_dict)
+                print(
+                    f"Consumed RecommendationsEvent for user: {recommendations_event.user_id}")
+                recommendations_event.state = State.in_progress
+            except Exception as err:
+                print(f"Error attempting to ingest message from RMQ -> {err}")
+                raise err
+            new_reccs, error = await self.recommendations.process_recommendations(user_id=recommendations_event.user_id)
+            if error:
+                print(f"Error {error} calculating reccs for user: {recommendations_event.user_id}")
+                recommendations_event.state = State.fail
+            else:
+                print(f"Successfully calculated Recommendations for user: {recommendations_event.user_id}")
+                recommendations_event.state = State.ok
+                recommendations_event.reccomendations = new_reccs
+
+            if message.correlation_id:
+                print(f"Returning RecommendationsEvent for {recommendations_event.user_id}")
+
+                exception_new = await self.rabbitmq_client.publish_new(message=recommendations_event.deconstruct(),
+                                                                    correlation_id=message.correlation_id,
+                                                                    routing_key=message.reply_to, default=True)
+                if exception_new:
+                    print(f"Error {exception_new} when attempting to send recommendations event back to the reply queue")
+                else:
+                    print(f"Published RecommendationsEvent back to it's source")
+            else:
+                print(f"No correlation ID. Not publishing back to reply queue.")
+
 
 def main():
+    config = Config()
+    if config.METRICS_PORT:
+        print(f"Serving prometheus metrics on port {config.METRICS_PORT}")
+        start_http_server(int(config.METRICS_PORT))
     app = AsyncRMQ()
     try:
-        asyncio.run(app.consume_reccs_events())
+        asyncio.run(app.run())
     except Exception as e:
         print(f"An error occurred: {e}")
+    finally:
+        app.recommendations.calc_executor.shutdown()
     # try:
     #     loop = asyncio.get_event_loop()
     #     loop.run_until_complete(asyncio.gather(app.consume_reccs_events()))
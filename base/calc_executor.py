@@ -0,0 +1,132 @@
+"""
+Process pool that runs the CPU bound recommendation scoring off the asyncio event loop
+
+The consumer awaits ReccCalculator.do_calculate_timed through a CalculationExecutor so a big user does not block
+RabbitMQ heartbeats, Mongo and TMDB I/O for everyone else. Every stage, from merging the sources to formatting the
+results, runs in the worker: the tmdb_data dict is pickled straight to it, which stays affordable as the TMDB results
+are trimmed to TMDB_RESULT_FIELDS when parsed. The stage timings come back with the results and are replayed into the
+metrics sinks of the consumer process. The worker owns its unpickled copy of tmdb_data, so it always releases the
+sources once they are merged.
+
+A worker that dies (e.g. killed for running out of memory) breaks the whole pool. The pool is then replaced and the
+calculation is retried once.
+"""
+
+import asyncio
+import math
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from base.recc_calculator import ReccCalculator
+from base.recc_data import ReccInput
+
+# One calculator per worker process, created by the pool initializer
+worker_calculator = None
+
+
+def container_cpu_count() -> int:
+    """
+    Function to get the number of CPUs this container can use, taking the cgroup CPU quota into account
+    """
+    if hasattr(os, 'sched_getaffinity'):
+        cpus = len(os.sched_getaffinity(0))
+    else:
+        cpus = os.cpu_count() or 1
+
+    quota = None
+    try:
+        # cgroup v2
+        with open('/sys/fs/cgroup/cpu.max') as cpu_max:
+            limit, period = cpu_max.read().split()
+            if limit != 'max':
+                quota = int(limit) / int(period)
+    except (OSError, ValueError):
+        try:
+            # cgroup v1
+            with open('/sys/fs/cgroup/cpu/cpu.cfs_quota_us') as quota_file, \
+                    open('/sys/fs/cgroup/cpu/cpu.cfs_period_us') as period_file:
+                limit = int(quota_file.read())
+                if limit > 0:
+                    quota = limit / int(period_file.read())
+        except (OSError, ValueError):
+            pass
+
+    if quota:
+        cpus = min(cpus, math.ceil(quota))
+    return max(1, cpus)
+
+
+def init_worker():
+    global worker_calculator
+    # The consumer process reports the stage timings, the workers only return them
+    worker_calculator = ReccCalculator(metrics_sinks=[])
+
+
+def calculate_in_worker(tmdb_data: ReccInput) -> tuple:
+    return worker_calculator.do_calculate_timed(tmdb_data, release_input=True)
+
+
+class CalculationExecutor:
+
+    def __init__(self, workers: int = None) -> None:
+        if workers is None:
+            workers = container_cpu_count()
+        self.workers = workers
+        self.pool = None
+
+    def get_pool(self) -> ProcessPoolExecutor:
+        if self.pool is None:
+            print(f"Starting recommendation calculation pool with {self.workers} workers")
+            # spawn rather than fork, the consumer process already runs the motor and aio_pika threads
+            self.pool = ProcessPoolExecutor(max_workers=self.workers,
+                                            mp_context=multiprocessing.get_context('spawn'),
+                                            initializer=init_worker)
+        return self.pool
+
+    async def calculate(self, calculator: ReccCalculator, tmdb_data: ReccInput, release_input: bool = False) -> tuple:
+        """
+        Function to calculate the recommendations for a user in the process pool. The calculation is retried once on
+        a new pool when the pool breaks, and fails when it breaks again.
+        Runs on the calling process when the pool is disabled (0 workers).
+        When release_input is set the source lists of tmdb_data are emptied, as soon as they are merged in process or
+        once the results are back from the pool.
+        """
+        if self.workers == 0:
+            return calculator.do_calculate_timed(tmdb_data, release_input=release_input)
+
+        try:
+            results, timings = await self.calculate_in_pool(tmdb_data)
+        except BrokenProcessPool:
+            print("Retrying the recommendation calculation on a new pool")
+            results, timings = await self.calculate_in_pool(tmdb_data)
+
+        if release_input:
+            calculator.release_sources(tmdb_data)
+        calculator.report_timings(timings)
+        return results, timings
+
+    async def calculate_in_pool(self, tmdb_data: ReccInput) -> tuple:
+        """
+        Function to run the calculation in the process pool. A broken pool is replaced before the error is raised,
+        so later calculations do not fail with it.
+        """
+        pool = self.get_pool()
+        loop = asyncio.get_running_loop()
+        try:
+            return await loop.run_in_executor(pool, calculate_in_worker, tmdb_data)
+        except BrokenProcessPool:
+            self.reset_pool(pool)
+            raise
+
+    def reset_pool(self, pool: ProcessPoolExecutor):
+        # Every calculation running on the broken pool fails, only the first one replaces it
+        if self.pool is pool:
+            print("Recommendation calculation pool broke. Starting a new pool for the next calculations")
+            self.pool = None
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    def shutdown(self):
+        if self.pool is not None:
+            self.pool.shutdown(wait=True, cancel_futures=True)
+            self.pool = None
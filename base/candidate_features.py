@@ -0,0 +1,134 @@
+"""
+Array representation of the discovered media (base.candidates.Candidate) used by the vectorized scoring mode of the
+ReccCalculator
+
+CandidateFeatures is a pool of unique media, one row per media id. It holds the features that only depend on the
+media itself and can be shared between users:
+
+    genres      -> the genre ids of every media flattened into a single column, with the offset and number of the
+                   genre ids of every row
+    votes       -> vote_average vector, rounded the same way as ReccCalculator.assign_voting_weight
+
+The director, keyword and network a media was discovered through depend on the user, so they are passed in as that
+users tags (see candidate_tags) when scoring, and a user is only scored over their own rows of the pool. Every column
+is built with map/np.fromiter over the Candidate records, no python code runs per media, and the scores are ranked
+with a stable argsort rather than going through a Counter.
+"""
+
+from itertools import chain, repeat
+from operator import attrgetter
+import numpy as np
+
+# Tags of the occurrence of a media a user kept, see base.candidates.Candidate
+TAGS = ('director', 'keywords', 'networks')
+
+
+def candidate_tags(candidates: list) -> dict:
+    """
+    Function to get the tags of every candidate, tag -> one value per candidate in the same order
+    """
+    return {tag: list(map(attrgetter(tag), candidates)) for tag in TAGS}
+
+
+def tag_weights(values: list, most_common: list) -> np.ndarray:
+    """
+    Function to get the weight of the director, keyword or network (tag value) every candidate was discovered
+    through, 0 when it was not discovered through one of the users most common ones
+    """
+    lookup = {}
+    for unique_id, count in most_common:
+        lookup[unique_id] = lookup.get(unique_id, 0) + count
+    # Media not discovered through a tag have None, which never carries a weight
+    lookup.pop(None, None)
+    if not lookup:
+        return np.zeros(len(values), dtype=np.float64)
+
+    return np.fromiter(map(lookup.get, values, repeat(0)), dtype=np.float64, count=len(values))
+
+
+def round_votes(votes: np.ndarray) -> np.ndarray:
+    """
+    Function to round every vote to 3 decimals exactly like round(vote, 3). TMDB votes already have at most 3
+    decimals: for those n / 1000 == vote means vote is the double closest to n / 1000, which is what round returns,
+    so only the other votes go through round.
+    """
+    thousandths = np.rint(votes * 1000)
+    rounded = thousandths / 1000
+    inexact = np.flatnonzero(rounded != votes)
+    if len(inexact):
+        rounded[inexact] = [round(vote, 3) for vote in votes[inexact].tolist()]
+    return rounded
+
+
+def rank(ids: list, scores: np.ndarray, top_k: int = None) -> list:
+    """
+    Function to order the (id, score) pairs by score, highest first. Ties keep the order of ids, the same as
+    Counter.most_common.
+    """
+    order = np.argsort(-scores, kind='stable')
+    if top_k:
+        order = order[:top_k]
+
+    return list(zip(map(ids.__getitem__, order.tolist()), scores[order].tolist()))
+
+
+class CandidateFeatures:
+
+    def __init__(self, candidates: list) -> None:
+        self.ids = list(map(attrgetter('id'), candidates))
+
+        genre_ids = list(map(attrgetter('genre_ids'), candidates))
+        self.genre_counts = np.fromiter(map(len, genre_ids), dtype=np.intp, count=len(genre_ids))
+        self.genre_offsets = np.cumsum(self.genre_counts) - self.genre_counts
+        # TMDB genre ids are integers
+        self.genres = np.fromiter(chain.from_iterable(genre_ids), dtype=np.int64,
+                                  count=int(self.genre_counts.sum()))
+        self.votes = round_votes(np.fromiter(map(attrgetter('vote_average'), candidates), dtype=np.float64,
+                                             count=len(self.ids)))
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def genre_weights(self, genres: list, rows: np.ndarray = None) -> np.ndarray:
+        """
+        Function to count, for every media in rows (the whole pool when None), how many of its genres the user has
+        rated. Only the genre ids of those rows are matched.
+        """
+        genre_id_list = set()
+        for genre in genres:
+            for genre_id in genre[0].split(','):
+                # ReccCalculator.assign_genre_weight matches str(genre), which only ever equals the canonical string
+                if genre_id.lstrip('-').isdigit() and str(int(genre_id)) == genre_id:
+                    genre_id_list.add(int(genre_id))
+
+        if rows is None:
+            counts = self.genre_counts
+            user_genres = self.genres
+        else:
+            counts = self.genre_counts[rows]
+            # Position of every genre id of the rows in self.genres: the offset of its row plus its index in the row
+            starts = np.cumsum(counts) - counts
+            user_genres = self.genres[np.repeat(self.genre_offsets[rows] - starts, counts) +
+                                      np.arange(int(counts.sum()))]
+
+        matches = np.isin(user_genres, list(genre_id_list))
+        return np.bincount(np.repeat(np.arange(len(counts)), counts), weights=matches, minlength=len(counts))
+
+    def score(self, tags: dict, counts: np.ndarray, genres: list, directors: list, keywords: list,
+              networks: list = None, rows: np.ndarray = None) -> np.ndarray:
+        """
+        Function to apply every weight stage as array operations over a users candidates. tags are the users tags
+        (see candidate_tags) and rows the pool rows of the candidates, None when the pool was built from the
+        candidates themselves.
+        The stages are added in the same order as the python scoring so the float results are identical.
+        """
+        genre_weights = self.genre_weights(genres, rows)
+        votes = self.votes if rows is None else self.votes[rows]
+        scores = counts + genre_weights
+        scores = scores + votes
+        scores = scores + tag_weights(tags['director'], directors)
+        if networks is not None:
+            scores = scores + tag_weights(tags['networks'], networks)
+        scores = scores + tag_weights(tags['keywords'], keywords)
+
+        return scores
@@ -0,0 +1,65 @@
+"""
+Compact representation of the media discovered for a user
+
+The TMDB responses carry overviews, poster/backdrop paths and other fields the ReccCalculator never reads.
+A Candidate only keeps the fields used for scoring and a CandidateSet keeps one Candidate per media id, the number
+of times that media was discovered and a side table with the display fields of its first occurrence, so the raw
+responses can be released once they are indexed.
+"""
+
+from collections import Counter
+
+
+def display_info(media: dict, display_fields: tuple) -> dict:
+    """
+    Function to get the fields of a discovered media that are stored with the recommendations
+    """
+    return {field: media[field] for field in display_fields if field in media}
+
+
+class Candidate:
+
+    __slots__ = ('id', 'genre_ids', 'vote_average', 'director', 'keywords', 'networks')
+
+    def __init__(self, media: dict) -> None:
+        self.id = media['id']
+        self.genre_ids = tuple(media.get('genre_ids', ()))
+        self.vote_average = media.get('vote_average', 0)
+        # Tags added by TmdbClient.make_parallel_discover_request, None when the media was not discovered that way
+        self.director = media.get('director')
+        self.keywords = media.get('keywords')
+        self.networks = media.get('networks')
+
+    def __repr__(self) -> str:
+        return f"Candidate(id={self.id})"
+
+
+class CandidateSet:
+
+    def __init__(self, display_fields: tuple) -> None:
+        self.display_fields = display_fields
+        # weights and candidates are both keyed in the order the media were first discovered
+        self.weights = Counter()
+        self.candidates = {}
+        self.info = {}
+
+    def __len__(self) -> int:
+        return len(self.candidates)
+
+    def __iter__(self):
+        return iter(self.candidates.values())
+
+    def add(self, media: dict):
+        """
+        Function to add a discovered media. The first occurrence of a media is kept and every occurrence adds 1 to
+        its weight.
+        """
+        media_id = media['id']
+        self.weights[media_id] += 1
+        if media_id not in self.candidates:
+            self.candidates[media_id] = Candidate(media)
+            self.info[media_id] = display_info(media, self.display_fields)
+
+    def extend(self, discovered_data: list):
+        for media in discovered_data:
+            self.add(media)
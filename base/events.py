@@ -2,8 +2,23 @@ from uuid import uuid4
 import datetime
 import pickle
 from enum import Enum, auto
+from bson import ObjectId
 from env_config import Config
 
+
+def to_wire(value):
+    """
+    Convert the Mongo types that can not be sent as JSON (ObjectId, datetime) to strings.
+    Applied once, when an event is deconstructed to be published to RabbitMQ.
+    """
+    if isinstance(value, dict):
+        return {key: to_wire(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [to_wire(item) for item in value]
+    if isinstance(value, (ObjectId, datetime.datetime)):
+        return str(value)
+    return value
+
 def define_state(state: str):
     # Construct State enum
     if isinstance(state, State):
@@ -59,7 +74,7 @@ class RecommendationsEvent:
             "user_id": self.user_id,
             "uuid": self.uuid,
             "parent_uuid": self.parent_uuid,
-            "reccomendations": self.reccomendations,
+            "reccomendations": to_wire(self.reccomendations),
             "duration": self.duration,
             "result_routing_key": self.result_routing_key,
             "state": self.state.name,
@@ -0,0 +1,36 @@
+"""
+Latency of the recent TMDB requests, used to decide when to hedge a request
+
+A hedged request sends a duplicate of a request that is taking longer than the given percentile of the recent
+successful requests and uses whichever answer returns first. No request is hedged until there are min_samples
+samples.
+"""
+
+import threading
+from collections import deque
+
+
+class LatencyTracker:
+
+    def __init__(self, percentile: float, window: int = 500, min_samples: int = 20) -> None:
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.samples = deque(maxlen=window)
+        self.lock = threading.Lock()
+
+    def observe(self, seconds: float):
+        with self.lock:
+            self.samples.append(seconds)
+
+    def hedge_delay(self):
+        """
+        Function to get the seconds after which a request is hedged, None when hedging is disabled
+        """
+        if self.percentile <= 0:
+            return None
+        with self.lock:
+            if len(self.samples) < self.min_samples:
+                return None
+            ordered = sorted(self.samples)
+        index = min(len(ordered) - 1, int(len(ordered) * self.percentile / 100))
+        return ordered[index]
@@ -0,0 +1,53 @@
+"""
+Metrics sinks for the stages of the ReccCalculator scoring pipeline
+
+A sink is any object with an observe(stage, seconds, candidates) method. The calculator reports every stage it runs
+to each of its sinks:
+
+    StageTimings            -> keeps the stages of a single calculation in a dict, returned with the results
+    PrometheusStageMetrics  -> records every stage into process wide prometheus histograms
+"""
+
+from prometheus_client import Histogram
+
+STAGE_SECONDS = Histogram('recc_calculator_stage_seconds', 'Wall time of a recommendation scoring stage',
+                          labelnames=['stage'],
+                          buckets=(.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10))
+STAGE_CANDIDATES = Histogram('recc_calculator_stage_candidates', 'Candidates left after a recommendation scoring stage',
+                             labelnames=['stage'],
+                             buckets=(10, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 25000, 50000))
+
+
+class StageTimings:
+
+    def __init__(self) -> None:
+        self.stages = {}
+
+    def observe(self, stage: str, seconds: float, candidates: int):
+        self.stages[stage] = {'seconds': round(seconds, 6), 'candidates': candidates}
+
+    def total(self) -> float:
+        return round(sum(stage['seconds'] for stage in self.stages.values()), 6)
+
+    def deconstruct(self) -> dict:
+        return dict(self.stages, total={'seconds': self.total()})
+
+
+class PrometheusStageMetrics:
+
+    def observe(self, stage: str, seconds: float, candidates: int):
+        STAGE_SECONDS.labels(stage=stage).observe(seconds)
+        STAGE_CANDIDATES.labels(stage=stage).observe(candidates)
+
+
+def configured_sinks(sink_names: str) -> list:
+    """
+    Function to build the sinks listed (comma separated) in RECC_METRICS_SINKS
+    """
+    sinks = []
+    for name in filter(None, (name.strip() for name in (sink_names or '').split(','))):
+        if name == 'prometheus':
+            sinks.append(PrometheusStageMetrics())
+        else:
+            print(f"Unknown recommendation metrics sink: {name}")
+    return sinks
@@ -1,5 +1,6 @@
 from motor.core import AgnosticDatabase, AgnosticCollection
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ASCENDING, DESCENDING
 from env_config import Config
 
 
@@ -30,6 +31,32 @@ class MongoClient:
             return self.client.whattowatch.recommended_televisions
         return self.client.whattowatch.recommended_movies
 
+    def recommendation_state_collection(self) -> AgnosticCollection:
+        return self.node_db()[self.config.RECOMMENDATIONS_STATE_COLLECTION]
+
+    def taste_profile_collection(self) -> AgnosticCollection:
+        return self.node_db()[self.config.TASTE_PROFILE_COLLECTION]
+
+    def tmdb_cache_collection(self) -> AgnosticCollection:
+        # The cached urls include the media type so movies and television share the collection
+        return self.client.whattowatch.tmdb_responses
+
+    async def ensure_indexes(self):
+        """
+        Function to create the indexes the per user queries rely on. Existing indexes are left as they are.
+        """
+        try:
+            await self.rated_collection().create_index([('user_id', ASCENDING), ('updatedAt', DESCENDING)])
+            await self.recommended_collection().create_index([('user_id', ASCENDING)])
+            await self.recommendation_state_collection().create_index([('user_id', ASCENDING)], unique=True)
+            await self.taste_profile_collection().create_index([('user_id', ASCENDING)], unique=True)
+            await self.tmdb_cache_collection().create_index([('expireAt', ASCENDING)], expireAfterSeconds=0)
+            print("Mongo indexes are in place")
+            return None
+        except Exception as error:
+            print(f"Error attempting to create Mongo indexes: {error}")
+            return error
+
     async def ping(self) -> bool:
         try:
             await self.node_db().list_collection_names()
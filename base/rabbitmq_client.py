@@ -58,6 +58,13 @@ class RabbitMqClient:
                 self.exchange = await self.channel.declare_exchange(name=self.exchange_name, durable=True)
                 print(f"RabbitMQ Exchange {self.exchange} is declared")
 
+    async def set_prefetch(self, count: int):
+        """
+        This function limits the number of unacknowledged messages delivered to this channel
+        """
+        await self.refresh_channel()
+        await self.channel.set_qos(prefetch_count=count)
+
     async def close(self):
         """
         This function closes the connection and channel
@@ -0,0 +1,124 @@
+"""
+Process wide rate limiting of the TMDB requests
+
+Every TmdbClient in a process shares one RateLimiter so a burst of recomputes stays under the TMDB limits:
+
+    token bucket    -> at most `rate` requests a second, with bursts of up to `burst` requests
+    concurrency     -> requests in flight per event loop. The limit is adaptive: it is halved on a 429 or 5xx
+                       response and grows back by about one for every `limit` successful responses
+    Retry-After     -> a 429/503 with a Retry-After header holds every new request until it has passed
+
+The bucket and the adaptive limit are shared by every event loop in the process (Flask runs a loop per request),
+the requests in flight are counted per event loop.
+"""
+
+import asyncio
+import random
+import threading
+import time
+import weakref
+
+
+def parse_retry_after(value) -> float:
+    """
+    Function to get the seconds of a Retry-After header, None when it is missing or not a number of seconds
+    """
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        return None
+
+
+def backoff_seconds(attempt: int, base: float, cap: float, retry_after: float = None) -> float:
+    """
+    Function to get how long to wait before retrying, the Retry-After of the response or an exponential backoff
+    with full jitter
+    """
+    if retry_after is not None:
+        return min(cap, retry_after)
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+class RateLimiter:
+
+    def __init__(self, rate: float, burst: int, max_concurrency: int, min_concurrency: int = 1) -> None:
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.max_concurrency = max(1, max_concurrency)
+        self.min_concurrency = max(1, min(min_concurrency, self.max_concurrency))
+        self.limit = float(self.max_concurrency)
+        self.tokens = float(self.burst)
+        self.refilled_at = time.monotonic()
+        self.blocked_until = 0.0
+        self.lock = threading.Lock()
+        # Event loop -> (condition, requests in flight)
+        self.loops = weakref.WeakKeyDictionary()
+
+    def concurrency(self) -> int:
+        return int(self.limit)
+
+    def loop_state(self) -> list:
+        loop = asyncio.get_running_loop()
+        state = self.loops.get(loop)
+        if state is None:
+            state = [asyncio.Condition(), 0]
+            self.loops[loop] = state
+        return state
+
+    async def acquire(self):
+        """
+        Function to wait for a concurrency slot and a token
+        """
+        state = self.loop_state()
+        condition = state[0]
+        async with condition:
+            await condition.wait_for(lambda: state[1] < self.concurrency())
+            state[1] += 1
+
+        try:
+            while True:
+                wait = self.take_token()
+                if wait <= 0:
+                    return
+                await asyncio.sleep(wait)
+        except BaseException:
+            await self.release_slot(state)
+            raise
+
+    def take_token(self) -> float:
+        """
+        Function to take a token from the bucket. Returns 0 when one was taken, otherwise the seconds to wait.
+        """
+        with self.lock:
+            now = time.monotonic()
+            if now < self.blocked_until:
+                return self.blocked_until - now
+            if self.rate <= 0:
+                return 0
+            self.tokens = min(self.burst, self.tokens + (now - self.refilled_at) * self.rate)
+            self.refilled_at = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0
+            return (1 - self.tokens) / self.rate
+
+    async def release(self, status: int = None, retry_after: float = None):
+        """
+        Function to release the slot of a finished request and adapt the concurrency to its response
+        """
+        with self.lock:
+            if status == 429 or (status is not None and status >= 500):
+                self.limit = max(self.min_concurrency, self.limit / 2)
+                if retry_after:
+                    self.blocked_until = max(self.blocked_until, time.monotonic() + retry_after)
+            elif status is not None and status < 400:
+                self.limit = min(self.max_concurrency, self.limit + 1 / self.limit)
+
+        await self.release_slot(self.loop_state())
+
+    @staticmethod
+    async def release_slot(state: list):
+        condition = state[0]
+        async with condition:
+            state[1] -= 1
+            condition.notify_all()
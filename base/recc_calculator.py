@@ -55,10 +55,6 @@ e.g.
 https://api.themoviedb.org/3/discover/movie?include_adult=false&include_video=false&language=en-US&page=1&sort_by=vote_average.desc&vote_average.gte=6&vote_count.gte=1000&with_crew=9032%7C1032&with_genres=18%7C80%7C53
 
 
-Can we get more than 10 in the response? Try and get 100
-
-Parallel requests with different pages
-
 -- 
 
 
@@ -76,105 +72,300 @@ For every movie I've rated, add 1 point to the weight for the decade it was rele
 
 """
 
+import time
 from collections import Counter
+from operator import itemgetter, methodcaller
+import numpy as np
+from base.candidate_features import TAGS, CandidateFeatures, candidate_tags, rank
+from base.candidates import Candidate, CandidateSet, display_info
+from base.metrics import StageTimings, configured_sinks
+from base.recc_data import ReccInput
 from env_config import Config
 
 
+class CalculationContext:
+    """
+    State handed from stage to stage while calculating the recommendations for a user
+    """
+
+    def __init__(self, tmdb_data: ReccInput, release_input: bool = False) -> None:
+        self.tmdb_data = tmdb_data
+        # Whether the merge stage may empty the source lists of tmdb_data, see ReccCalculator.release_sources
+        self.release_input = release_input
+        self.discovered_data = []
+        self.candidates = None
+        self.candidate_list = []
+        self.media_weights = None
+        # (id, weight) pairs ordered by weight, set by the stages that rank the candidates themselves
+        self.ranked = None
+        self.results = []
+
+
 class ReccCalculator:
 
-    def __init__(self) -> None:
+    def __init__(self, metrics_sinks: list = None) -> None:
         self.config = Config()
+        if metrics_sinks is None:
+            metrics_sinks = configured_sinks(self.config.RECC_METRICS_SINKS)
+        self.metrics_sinks = metrics_sinks
 
-    def do_calculate(self, tmdb_data: dict) -> list:
+    def do_calculate(self, tmdb_data: ReccInput, release_input: bool = False) -> list:
         '''
-            Function that generates the recommendations for a user
+            Function that generates the recommendations for a user.
+            tmdb_data is left as it is, unless release_input is set: the source lists are then emptied once they
+            are merged (see release_sources), for callers that are done with them.
             # TODO SOME ERROR HANDLING
         '''
+        formatted_results, _ = self.do_calculate_timed(tmdb_data, release_input=release_input)
 
-        discover_directors = tmdb_data['discover_directors']
-        discover_networks = tmdb_data['discover_networks']
-        discover_keywords = tmdb_data['discover_keywords']
-        discover_genres = tmdb_data['discover_genres']
-        similar_movies = tmdb_data['similar_movies']
-        recommeded_movies = tmdb_data['recommeded_movies']
-        rated_movies = tmdb_data['rated_movies']
-        directors = tmdb_data['directors']
-        genres = tmdb_data['genres']
-        keywords = tmdb_data['keywords']
-        networks = tmdb_data['networks']
+        return formatted_results
 
-        discovered_data = []
-        discovered_data.extend(discover_genres)
-        discovered_data.extend(discover_keywords)
-        discovered_data.extend(discover_directors)
-        discovered_data.extend(discover_networks)
-        discovered_data.extend(similar_movies)
-        discovered_data.extend(recommeded_movies)
+    def do_calculate_timed(self, tmdb_data: ReccInput, release_input: bool = False) -> tuple:
+        '''
+            Function that generates the recommendations for a user by running every stage of the pipeline in order.
+            Each stage reports its wall time and the number of candidates it left to the metrics sinks.
+            Returns the recommendations and the timings of every stage.
+            tmdb_data is left as it is, unless release_input is set: the source lists are then emptied once they
+            are merged (see release_sources), for callers that are done with them.
+        '''
+        timings = StageTimings()
+        sinks = [timings] + self.metrics_sinks
+        context = CalculationContext(tmdb_data, release_input=release_input)
+        for name, stage in self.pipeline():
+            start = time.perf_counter()
+            candidates = stage(context)
+            seconds = time.perf_counter() - start
+            for sink in sinks:
+                sink.observe(stage=name, seconds=seconds, candidates=candidates)
+
+        return context.results, timings.deconstruct()
+
+    def report_timings(self, timings: dict):
+        '''
+        Function to report stage timings measured in another process to this calculators metrics sinks
+        '''
+        for stage, values in timings.items():
+            if stage == 'total':
+                continue
+            for sink in self.metrics_sinks:
+                sink.observe(stage=stage, seconds=values['seconds'], candidates=values['candidates'])
 
+    def pipeline(self) -> list:
+        '''
+        Function that returns the ordered (name, stage) pairs used to calculate the recommendations.
+        Every stage updates the CalculationContext and returns the number of candidates left after it.
+        '''
+        stages = [('merge', self.merge_stage),
+                  ('delete_existing', self.delete_existing_stage),
+                  ('dedup', self.dedup_stage)]
+
+        if self.config.RECC_SCORING_MODE == 'vectorized':
+            stages.append(('vectorized', self.vectorized_stage))
+        else:
+            stages.extend([('genre', self.genre_stage),
+                           ('voting', self.voting_stage),
+                           ('director', self.director_stage)])
+            # Assign weight from networks for tv only
+            if self.config.NODE_ENV == "tv":
+                stages.append(('network', self.network_stage))
+            stages.append(('keyword', self.keyword_stage))
+
+        stages.append(('format', self.format_stage))
+        return stages
+
+    def merge_stage(self, context: CalculationContext) -> int:
+        context.discovered_data = self.merge_sources(context.tmdb_data)
+        if context.release_input:
+            self.release_sources(context.tmdb_data)
+        return len(context.discovered_data)
+
+    def delete_existing_stage(self, context: CalculationContext) -> int:
         # REMOVE ALL RATED MOVIES
-        existing_ids = []
-        for item in rated_movies:
-            existing_ids.append(item[self.config.ID_KEY])
+        context.discovered_data = self.delete_existing(context.discovered_data, self.rated_ids(context.tmdb_data))
+        return len(context.discovered_data)
+
+    def dedup_stage(self, context: CalculationContext) -> int:
+        # Count occurrences and remove duplicates of movies from discovery list in a single pass
+        context.candidates = self.index_candidates(context.discovered_data)
+        context.candidate_list = list(context.candidates)
+        context.media_weights = context.candidates.weights
+        context.discovered_data = []
+        return len(context.candidates)
+
+    def genre_stage(self, context: CalculationContext) -> int:
+        context.media_weights = self.assign_genre_weight(media_weights=context.media_weights,
+                                                         genres=context.tmdb_data['genres'],
+                                                         discovered_data=context.candidate_list)
+        return len(context.candidate_list)
+
+    def voting_stage(self, context: CalculationContext) -> int:
+        context.media_weights = self.assign_voting_weight(media_weights=context.media_weights,
+                                                          discovered_data=context.candidate_list)
+        return len(context.candidate_list)
+
+    def director_stage(self, context: CalculationContext) -> int:
+        context.media_weights = self.assign_director_weight(media_weights=context.media_weights,
+                                                            discovered_data=context.candidate_list,
+                                                            directors=context.tmdb_data['directors'])
+        return len(context.candidate_list)
+
+    def network_stage(self, context: CalculationContext) -> int:
+        context.media_weights = self.assign_networks_weight(media_weights=context.media_weights,
+                                                            discovered_data=context.candidate_list,
+                                                            networks=context.tmdb_data['networks'])
+        return len(context.candidate_list)
+
+    def keyword_stage(self, context: CalculationContext) -> int:
+        context.media_weights = self.assign_keyword_weight(media_weights=context.media_weights,
+                                                           discovered_data=context.candidate_list,
+                                                           keywords=context.tmdb_data['keywords'])
+        return len(context.candidate_list)
+
+    def vectorized_stage(self, context: CalculationContext) -> int:
+        tmdb_data = context.tmdb_data
+        context.ranked = self.rank_vectorized(candidates=context.candidates,
+                                              genres=tmdb_data['genres'],
+                                              directors=tmdb_data['directors'],
+                                              keywords=tmdb_data['keywords'],
+                                              networks=tmdb_data['networks'])
+        return len(context.candidate_list)
+
+    def format_stage(self, context: CalculationContext) -> int:
+        if context.ranked is not None:
+            context.results = self.format_ranked(ranked=context.ranked, media_index=context.candidates.info)
+        else:
+            context.results = self.format_results(media_weights=context.media_weights,
+                                                  media_index=context.candidates.info)
+        return len(context.results)
+
+    def do_calculate_many(self, tmdb_data_list: list) -> list:
+        '''
+            Function that generates the recommendations for many users at once.
+            A media discovered by several users is parsed into a single Candidate, display info and row of a shared
+            CandidateFeatures pool. Each user only keeps the ids, counts and tags of their own candidates and is
+            scored over their own rows of that pool. Returns one result per tmdb_data, in the same order.
+        '''
+        pool = {}
+        info = {}
+        users = [self.index_user(tmdb_data, pool, info) for tmdb_data in tmdb_data_list]
+
+        features = CandidateFeatures(list(pool.values()))
+        print(f"Scoring {len(users)} users over a shared pool of {len(features)} media")
+
+        rows = dict(zip(pool, range(len(pool))))
+        results = []
+        for tmdb_data, (weights, tags) in zip(tmdb_data_list, users):
+            ids = list(weights)
+            ranked = self.rank_features(features=features,
+                                        ids=ids,
+                                        counts=np.fromiter(weights.values(), dtype=np.int64, count=len(ids)),
+                                        tags=tags,
+                                        genres=tmdb_data['genres'],
+                                        directors=tmdb_data['directors'],
+                                        keywords=tmdb_data['keywords'],
+                                        networks=tmdb_data['networks'],
+                                        rows=np.fromiter(map(rows.__getitem__, ids), dtype=np.intp, count=len(ids)))
+            results.append(self.format_ranked(ranked=ranked, media_index=info))
+
+        return results
+
+    def index_user(self, tmdb_data: ReccInput, pool: dict, info: dict) -> tuple:
+        '''
+        Function that indexes the media discovered for one user of do_calculate_many. Media not in the shared pool
+        yet are parsed into a Candidate and display info, the rest only cost a lookup.
+        Returns the number of times every media was discovered, in the order they were first discovered, and the
+        tags of the first occurrence of every media in that same order.
+        '''
+        rated_ids = self.rated_ids(tmdb_data)
+        discovered_data = [media for media in self.merge_sources(tmdb_data) if media['id'] not in rated_ids]
+        ids = list(map(itemgetter('id'), discovered_data))
+        weights = Counter(ids)
+        # Walking the media backwards leaves the first occurrence of every media in the dict
+        first = dict(zip(reversed(ids), reversed(discovered_data)))
+        # Membership tests only, a set difference with the pool would walk the whole pool for every user
+        for media_id in [media_id for media_id in weights if media_id not in pool]:
+            pool[media_id] = Candidate(first[media_id])
+            info[media_id] = display_info(first[media_id], self.config.RECC_DISPLAY_FIELDS)
+
+        occurrences = list(map(first.__getitem__, weights))
+        # Networks are only weighted for tv
+        weighted_tags = TAGS if self.config.NODE_ENV == "tv" else ('director', 'keywords')
+        tags = {tag: list(map(methodcaller('get', tag), occurrences)) for tag in weighted_tags}
+        return weights, tags
+
+    def prepare_candidates(self, tmdb_data: ReccInput) -> CandidateSet:
+        '''
+        Function that merges the discovered media, removes the media the user has already rated and deduplicates them
+        into compact Candidate records
+        '''
+        discovered_data = self.merge_sources(tmdb_data)
 
-        discovered_data = self.delete_existing(discovered_data, existing_ids)
+        # REMOVE ALL RATED MOVIES
+        discovered_data = self.delete_existing(discovered_data, self.rated_ids(tmdb_data))
 
-        media_weights = []
+        # Count occurrences and remove duplicates of movies from discovery list in a single pass
+        return self.index_candidates(discovered_data)
 
-        for media in discovered_data:
-            media_weights.append(media['id'])
-
-        media_weights = Counter(media_weights)
-
-        # Remove duplicates of movies from discovery list
-        for key, value in media_weights.items():
-            occurrences = []
-            for index, item in enumerate(discovered_data):
-                if value > 1 and item['id'] == key:
-                    occurrences.append(index)
-            if occurrences:
-                sorted_occurence = sorted(occurrences, reverse=True)
-                for i in sorted_occurence:
-                    if i == sorted_occurence[-1]:
-                        pass
-                    else:
-                        del discovered_data[i]
-
-        # Assign weight from genres
-        media_weights = self.assign_genre_weight(media_weights=media_weights, genres=genres,
-                                                 discovered_data=discovered_data)
-
-        # Assign weight from ratings
-        media_weights = self.assign_voting_weight(
-            media_weights=media_weights, discovered_data=discovered_data)
-
-        # Assign weight from directors
-        media_weights = self.assign_director_weight(
-            media_weights=media_weights, discovered_data=discovered_data, directors=directors)
-
-        # Assign weight from networks for tv only
-        if self.config.NODE_ENV == "tv":
-            media_weights = self.assign_networks_weight(
-                media_weights=media_weights, discovered_data=discovered_data, networks=networks)
-
-        # Assign weight from keywords
-        media_weights = self.assign_keyword_weight(
-            media_weights=media_weights, discovered_data=discovered_data, keywords=keywords)
-
-        # Format results
-        formatted_results = self.format_results(
-            media_weights=media_weights, discovered_data=discovered_data)
+    @staticmethod
+    def merge_sources(tmdb_data: ReccInput) -> list:
+        '''
+        Function that combines every discovered media into a single list. The order decides which occurrence of a
+        media is kept when deduplicating.
+        '''
+        discovered_data = []
+        discovered_data.extend(tmdb_data['discover_genres'])
+        discovered_data.extend(tmdb_data['discover_keywords'])
+        discovered_data.extend(tmdb_data['discover_directors'])
+        discovered_data.extend(tmdb_data['discover_networks'])
+        discovered_data.extend(tmdb_data['similar_movies'])
+        discovered_data.extend(tmdb_data['recommeded_movies'])
 
-        return formatted_results
+        return discovered_data
+
+    @staticmethod
+    def release_sources(tmdb_data: ReccInput):
+        '''
+        Function that empties the source lists once they are merged, so the raw TMDB results of duplicates and rated
+        media are freed as the candidates are indexed. Only their display fields are kept after that.
+        '''
+        for source in ('discover_genres', 'discover_keywords', 'discover_directors', 'discover_networks',
+                       'similar_movies', 'recommeded_movies'):
+            tmdb_data[source] = []
+        if 'media_results' in tmdb_data:
+            tmdb_data['media_results'] = {}
+
+    def rated_ids(self, tmdb_data: ReccInput) -> set:
+        existing_ids = set()
+        for item in tmdb_data['rated_movies']:
+            existing_ids.add(item[self.config.ID_KEY])
+
+        return existing_ids
 
     @staticmethod
     def delete_existing(rec_list, existing_id_list) -> list:
-        existing_occurences = []
-        for index, item in enumerate(rec_list):
-            if item['id'] in existing_id_list:
-                existing_occurences.append(index)
-        for i in sorted(existing_occurences, reverse=True):
-            del rec_list[i]
-        return rec_list
+        existing_ids = set(existing_id_list)
+        return [item for item in rec_list if item['id'] not in existing_ids]
+
+    def index_candidates(self, discovered_data) -> CandidateSet:
+        '''
+        Function that builds the id -> candidate index for the discovered data in a single pass.
+        The first occurrence of a media is kept and the number of times it was discovered becomes its starting weight.
+        '''
+        candidates = CandidateSet(display_fields=self.config.RECC_DISPLAY_FIELDS)
+        candidates.extend(discovered_data)
+
+        return candidates
+
+    @staticmethod
+    def weight_lookup(most_common) -> dict:
+        '''
+        Function that converts a list of (id, count) pairs into a dict so each media only needs a single lookup
+        '''
+        lookup = {}
+        for unique_id, count in most_common:
+            lookup[unique_id] = lookup.get(unique_id, 0) + count
+
+        return lookup
 
     @staticmethod
     def assign_genre_weight(media_weights, genres, discovered_data):
@@ -184,21 +375,16 @@ class ReccCalculator:
             genre_id_list.extend(g)
         genre_id_list = set(genre_id_list)
         for movie in discovered_data:
-            for genre in movie['genre_ids']:
+            for genre in movie.genre_ids:
                 if str(genre) in genre_id_list:
-                    for key, value in media_weights.items():
-                        if movie['id'] == key:
-                            media_weights[key] += 1
+                    media_weights[movie.id] += 1
 
         return media_weights
 
     @staticmethod
     def assign_voting_weight(media_weights, discovered_data):
         for movie in discovered_data:
-            rating = movie['vote_average']
-            for key, value in media_weights.items():
-                if movie['id'] == key:
-                    media_weights[key] += round(rating, 3)
+            media_weights[movie.id] += round(movie.vote_average, 3)
 
         return media_weights
 
@@ -207,14 +393,11 @@ class ReccCalculator:
         '''
         Function that will identify the users most frequently rated director and append this to the movie weight. 
         '''
+        director_weights = ReccCalculator.weight_lookup(directors)
         for movie in discovered_data:
             # Not all movies will have the director populated
-            if 'director' in movie:
-                dir_id = movie['director']
-                movie_id = movie['id']
-                for dirs in directors:
-                    if dir_id == dirs[0]:
-                        media_weights[movie_id] += dirs[1]
+            if movie.director is not None and movie.director in director_weights:
+                media_weights[movie.id] += director_weights[movie.director]
 
         return media_weights
 
@@ -223,14 +406,11 @@ class ReccCalculator:
         '''
         Function that will identify the users most frequently rated networks and append this to the movie weight. 
         '''
+        network_weights = ReccCalculator.weight_lookup(networks)
         for media in discovered_data:
             # Not all movies will have the director populated
-            if 'networks' in media:
-                network = media['networks']
-                media_id = media['id']
-                for netw in networks:
-                    if network == netw[0]:
-                        media_weights[media_id] += netw[1]
+            if media.networks is not None and media.networks in network_weights:
+                media_weights[media.id] += network_weights[media.networks]
 
         return media_weights
 
@@ -239,45 +419,72 @@ class ReccCalculator:
         '''
         Function that will identify the users most frequently rated keywords and append this to the movie weight. 
         '''
+        keyword_weights = ReccCalculator.weight_lookup(keywords)
         for movie in discovered_data:
             # Not all movies will have the director populated
-            if 'keywords' in movie:
-                mov_keyword = movie['keywords']
-                movie_id = movie['id']
-                for key in keywords:
-                    if mov_keyword == key[0]:
-                        media_weights[movie_id] += key[1]
+            if movie.keywords is not None and movie.keywords in keyword_weights:
+                media_weights[movie.id] += keyword_weights[movie.keywords]
 
         return media_weights
 
-    def format_results(self, media_weights, discovered_data) -> list:
+    def rank_vectorized(self, candidates: CandidateSet, genres, directors, keywords, networks, top_k=None) -> list:
+        '''
+        Function that applies the genre, voting, director, network and keyword weights as array operations over
+        the candidate features and ranks the candidates, returning the (id, weight) pairs of the top_k
+        (or RECC_TOP_K) highest weighted media.
+        '''
+        candidate_list = list(candidates)
+        # The weights are in the same order as the candidates
+        ids = list(candidates.weights)
+        return self.rank_features(features=CandidateFeatures(candidate_list),
+                                  ids=ids,
+                                  counts=np.fromiter(candidates.weights.values(), dtype=np.int64, count=len(ids)),
+                                  tags=candidate_tags(candidate_list),
+                                  genres=genres, directors=directors, keywords=keywords, networks=networks,
+                                  top_k=top_k)
+
+    def rank_features(self, features: CandidateFeatures, ids: list, counts: np.ndarray, tags: dict, genres,
+                      directors, keywords, networks, rows: np.ndarray = None, top_k=None) -> list:
         '''
-        Function to parse the recommendations and populate them with relevant data
+        Function that scores a users candidates over a features pool and ranks them. ids, counts and tags are in
+        the same order, rows are the pool rows of the ids when the pool holds other media too.
         '''
+        if top_k is None:
+            top_k = self.config.RECC_TOP_K or None
+        if self.config.NODE_ENV != "tv":
+            # Networks are only weighted for tv
+            networks = None
+        scores = features.score(tags=tags, counts=counts, genres=genres, directors=directors, keywords=keywords,
+                                networks=networks, rows=rows)
 
-        sorted_weights = media_weights.most_common()
-        baseline = 0
-        updated_weights = []
-        formatted_results = []
+        return rank(ids, scores, top_k)
 
-        for index, value in enumerate(sorted_weights):
-            if index == 0:
-                baseline = value[1]
-            updated_weights.append(
-                {value[0]: round(100 / baseline * value[1])})
+    def format_results(self, media_weights, media_index, top_k=None) -> list:
+        '''
+        Function to parse the recommendations and populate them with relevant data.
+        When top_k (or RECC_TOP_K) is set only the k highest weighted media are selected, using a heap rather than a
+        full sort, and only those k are populated from the media index.
+        '''
+        if top_k is None:
+            top_k = self.config.RECC_TOP_K or None
 
-        for item in updated_weights:
-            media_key = list(item.keys())[0]
-            media_weight = list(item.values())[0]
+        # most_common() is ordered by weight so the results do not need to be sorted again
+        return self.format_ranked(ranked=media_weights.most_common(top_k), media_index=media_index)
+
+    def format_ranked(self, ranked, media_index) -> list:
+        '''
+        Function to populate (id, weight) pairs, already ordered by weight, with relevant data
+        '''
+        if not ranked:
+            return []
+
+        baseline = ranked[0][1]
+        formatted_results = []
+        for media_key, value in ranked:
             formatted_media = {
-                self.config.ID_KEY: media_key, 'weight': media_weight}
-            for media in discovered_data:
-                if media_key == media['id']:
-                    formatted_media[self.config.INFO_KEY] = media
-                    break
+                self.config.ID_KEY: media_key, 'weight': round(100 / baseline * value)}
+            if media_key in media_index:
+                formatted_media[self.config.INFO_KEY] = media_index[media_key]
             formatted_results.append(formatted_media)
 
-        formatted_results = sorted(
-            formatted_results, key=lambda k: k['weight'], reverse=True)
-
         return formatted_results
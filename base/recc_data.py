@@ -0,0 +1,32 @@
+"""
+Typed shape of the data handed from RecommendationsHelper to the ReccCalculator
+
+A ReccInput is a plain dict so it flows from the helper to the calculator (and to the calculation process pool)
+without being converted, while still documenting every key the calculator relies on.
+"""
+
+from typing import Any, Dict, List, Tuple, TypedDict
+
+
+class ReccInput(TypedDict, total=False):
+    # Discovered media, raw TMDB results. The discover results are tagged with the id they were discovered through
+    discover_directors: List[Dict[str, Any]]
+    discover_genres: List[Dict[str, Any]]
+    discover_keywords: List[Dict[str, Any]]
+    discover_networks: List[Dict[str, Any]]
+    similar_movies: List[Dict[str, Any]]
+    recommeded_movies: List[Dict[str, Any]]
+    # Media the user has already rated, only the ID_KEY of every media is required
+    rated_movies: List[Dict[str, Any]]
+    # The 6 most common details of the rated media as (id, count) pairs
+    directors: List[Tuple[Any, int]]
+    genres: List[Tuple[str, int]]
+    keywords: List[Tuple[Any, int]]
+    networks: List[Tuple[Any, int]]
+    # Sources with a failed TMDB request, scored with only the responses that arrived in partial mode
+    missing_sources: List[str]
+    # Calculation state used for incremental updates, see RecommendationsHelper.save_calc_state. media_results holds
+    # the similar_movies and recommeded_movies results of every top rated media, keyed by the media id as a string
+    top_media: List[Dict[str, Any]]
+    media_results: Dict[str, Dict[str, List[Dict[str, Any]]]]
+    incremental_updates: int
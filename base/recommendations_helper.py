@@ -1,23 +1,16 @@
 import asyncio
 import datetime
-import json
 from collections import Counter
 from typing import Optional
-from bson import ObjectId
 from base.mongoclient import MongoClient
 from base.recc_calculator import ReccCalculator
+from base.recc_data import ReccInput
+from base.taste_profile import TasteProfile, count_media_details
 from base.tmdbclient import TmdbClient
 from env_config import Config
 import traceback
 
 
-class JSONEncoder(json.JSONEncoder):
-    def default(self, o):
-        if isinstance(o, (ObjectId, datetime.datetime)):
-            return str(o)
-        return json.JSONEncoder.default(self, o)
-
-
 class RecommendationException(Exception):
     """
     class to handle exceptions in the Recommendations class
@@ -26,12 +19,19 @@ class RecommendationException(Exception):
 
 class RecommendationsHelper:
 
+    CANDIDATE_SOURCES = ('discover_directors', 'discover_genres', 'discover_keywords', 'discover_networks',
+                         'similar_movies', 'recommeded_movies')
+    # Sources requested per top rated media
+    MEDIA_SOURCES = ('similar_movies', 'recommeded_movies')
+
     def __init__(self) -> None:
         self.config = Config()
         self.mongo_client = MongoClient()
-        self.tmdb_client = TmdbClient()
+        self.tmdb_client = TmdbClient(mongo_client=self.mongo_client)
         self.recc_calculator = ReccCalculator()
         self.rec_collection = self.mongo_client.recommended_collection()
+        self.state_collection = self.mongo_client.recommendation_state_collection()
+        self.profile_collection = self.mongo_client.taste_profile_collection()
 
     async def monitor_in_progress(self, user_id) -> Optional[dict]:
         """
@@ -42,7 +42,8 @@ class RecommendationsHelper:
             print("Currently in the process of updating the recommendations. Will retry in 5 seconds to "
                   "check if complete... ")
             await asyncio.sleep(5)
-            stored_reccs, error = await self.query_mongo_for_user(user_id, self.config.RECOMMENDATIONS_COLLECTION)
+            stored_reccs, error = await self.query_mongo_for_user(user_id, self.config.RECOMMENDATIONS_COLLECTION,
+                                                                  query=self.media_query_build(user_id, limit=1))
             if error:
                 print(f"Error {error} attempting to get reccommended media ")
                 return None, RecommendationException
@@ -81,89 +82,341 @@ class RecommendationsHelper:
 
     async def gather_reccs_data(self, user_id: str):
         print("Attempting to gather all recommendation data...")
-        rated_media, error = await self.query_mongo_for_user(user_id, self.config.RATED_COLLECTION)
+        recc_data, error = await self.gather_reccs_details(user_id)
         if error:
-            print("Error attempting to get rated media")
             return None, RecommendationException
-        print(rated_media)
-        keywords = []
-        for item in rated_media:
-            keywords.append(item['keywords'])
-        try:
-            directors, genres, keywords, networks = self.extract_details_for_discover(
-                rated_media)  # BUG HERE
-        except Exception:
-            print("Error attempting to extract details for discover")
-            print(traceback.format_exc())
+
+        # Schedule every TMDB request at once, the TmdbClient limits how many are in flight
+        requests = {}
+        for source, request_type, detail in self.discover_sources():
+            requests[source] = self.tmdb_client.make_parallel_discover_request(request_type=request_type,
+                                                                               unique_id_list=recc_data[detail])
+        requests['similar_movies'] = self.tmdb_client.make_parallel_media_request(path='similar',
+                                                                                  medias=recc_data['top_media'])
+        requests['recommeded_movies'] = self.tmdb_client.make_parallel_media_request(path='recommendations',
+                                                                                     medias=recc_data['top_media'])
+
+        collections, error = await self.gather_sources(requests, medias=recc_data['top_media'])
+        if error:
             return None, RecommendationException
 
-        discover_directors = []
-        if self.config.NODE_ENV != 'tv':
-            disc_direc, error = await self.tmdb_client.make_parallel_discover_request(request_type='director',
-                                                                                      unique_id_list=directors)
+        recc_data.update(collections)
+        return recc_data, None
+
+    async def gather_reccs_details(self, user_id: str):
+        """
+        Gather everything about the users rated media the TMDB requests and the scoring need: the rated media ids,
+        the most common details and the top rated media
+        """
+        if self.config.RECC_DETAILS_SOURCE == 'aggregation':
+            aggregated, error = await self.aggregate_details_for_discover(user_id)
+            if error:
+                print("Error attempting to aggregate details for discover")
+                return None, RecommendationException
+            (directors, genres, keywords, networks), rated_media = aggregated
+        else:
+            profile, error = await self.load_taste_profile(user_id)
             if error:
-                print("Error attempting to get query discover for directors")
+                print("Error attempting to get the taste profile")
                 return None, RecommendationException
-            for item in disc_direc:
-                discover_directors.extend(item['results'])
+            try:
+                directors, genres, keywords, networks = self.most_common_details(*profile.counters())
+            except Exception:
+                print("Error attempting to extract details for discover")
+                print(traceback.format_exc())
+                return None, RecommendationException
+            rated_media = profile.rated_media(self.config.ID_KEY)
+
+        recc_data: ReccInput = {'rated_movies': [{self.config.ID_KEY: media[self.config.ID_KEY]}
+                                                 for media in rated_media],
+                                'directors': directors,
+                                'keywords': keywords,
+                                'networks': networks,
+                                'genres': genres,
+                                'top_media': self.get_top_rated_media(rated_media)}
 
-        discover_networks = []
+        return recc_data, None
+
+    def discover_sources(self) -> list:
+        """
+        The (source, request type, detail) of every discover request made for the current NODE_ENV
+        """
+        sources = []
+        if self.config.NODE_ENV != 'tv':
+            sources.append(('discover_directors', 'director', 'directors'))
         if self.config.NODE_ENV == 'tv':
-            disc_netw, error = await self.tmdb_client.make_parallel_discover_request(request_type='networks',
-                                                                                     unique_id_list=networks)
+            sources.append(('discover_networks', 'networks', 'networks'))
+        sources.append(('discover_genres', 'genre', 'genres'))
+        sources.append(('discover_keywords', 'keywords', 'keywords'))
+        return sources
+
+    async def stream_reccs_data(self, recc_data: ReccInput):
+        """
+        Async generator of the discovered media of the user, yielding (source, index, results) as soon as each TMDB
+        response arrives. One request is made per discover id and per top rated media, index is its position in
+        the source. Raises a RecommendationException when a request fails, in partial mode only when every request
+        fails and the sources with a failed request (or a failed page of one) are listed in
+        recc_data['missing_sources'].
+        """
+        missing_sources = recc_data.setdefault('missing_sources', [])
+        failed = 0
+        requests = {}
+        for source, request_type, detail in self.discover_sources():
+            for index, unique_id in enumerate(recc_data[detail]):
+                request = self.tmdb_client.make_parallel_discover_request(request_type=request_type,
+                                                                          unique_id_list=[unique_id])
+                requests[asyncio.ensure_future(request)] = (source, index)
+        for source, path in (('similar_movies', 'similar'), ('recommeded_movies', 'recommendations')):
+            for index, media in enumerate(recc_data['top_media']):
+                request = self.tmdb_client.make_parallel_media_request(path=path, medias=[media])
+                requests[asyncio.ensure_future(request)] = (source, index)
+
+        pending = set(requests)
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    source, index = requests[task]
+                    response, error = task.result()
+                    if error:
+                        print(f"Error attempting to get {source} from TMDB")
+                        failed += 1
+                        if not self.config.RECC_PARTIAL_RESULTS or failed == len(requests):
+                            raise RecommendationException(f"Unable to get {source} from TMDB")
+                        if source not in missing_sources:
+                            missing_sources.append(source)
+                        continue
+                    if self.failed_requests(response):
+                        print(f"Some pages of {source} could not be fetched from TMDB")
+                        if not self.config.RECC_PARTIAL_RESULTS:
+                            raise RecommendationException(f"Unable to get every page of {source} from TMDB")
+                        if source not in missing_sources:
+                            missing_sources.append(source)
+                    yield source, index, response[0]['results']
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def load_taste_profile(self, user_id: str):
+        """
+        Get the taste profile of a user, applying only the media rated or updated since it was last stored.
+        The profile is built from every rated media the first time and rebuilt when rated media were removed.
+        """
+        try:
+            stored = await self.profile_collection.find_one({'user_id': user_id})
+            if stored and stored.get('synced_at'):
+                profile = TasteProfile.reconstruct(stored)
+                new_rated, error = await self.query_mongo_for_user(
+                    user_id, self.config.RATED_COLLECTION,
+                    query=self.updated_media_query(user_id, profile.synced_at, projection=self.rated_media_projection()))
+                if error:
+                    print(f"Error {error} attempting to get newly rated media")
+                    return None, RecommendationException
+                for media in new_rated:
+                    profile.apply(media, self.config.ID_KEY)
+
+                rated_count = await self.mongo_client.rated_collection().count_documents({'user_id': user_id})
+                if rated_count == len(profile.ratings):
+                    if new_rated:
+                        await self.save_taste_profile(profile)
+                    return profile, None
+                print("Rated media were removed since the taste profile was stored. Rebuilding it")
+
+            rated_media, error = await self.query_mongo_for_user(
+                user_id, self.config.RATED_COLLECTION,
+                query=self.media_query_build(user_id, projection=self.rated_media_projection()))
             if error:
-                print("Error attempting to get query discover for networks")
+                print(f"Error {error} attempting to get rated media")
                 return None, RecommendationException
-            for item in disc_netw:
-                discover_networks.extend(item['results'])
-
-        discover_genres = []
-        disc_genre, error = await self.tmdb_client.make_parallel_discover_request(request_type='genre', unique_id_list=genres)
-        if error:
-            print("Error attempting to get query discover for genres")
+            profile = TasteProfile(user_id=user_id)
+            for media in rated_media:
+                profile.apply(media, self.config.ID_KEY)
+            await self.save_taste_profile(profile)
+        except Exception:
+            print("Error attempting to load the taste profile")
+            print(traceback.format_exc())
             return None, RecommendationException
-        for item in disc_genre:
-            discover_genres.extend(item['results'])
 
-        discover_keywords = []
-        disc_keywords, error = await self.tmdb_client.make_parallel_discover_request(request_type='keywords',
-                                                                                     unique_id_list=keywords)
-        if error:
-            print("Error attempting to get query discover for keywords")
-            return None, RecommendationException
-        for item in disc_keywords:
-            discover_keywords.extend(item['results'])
+        return profile, None
 
-        top_media = self.get_top_rated_media(rated_media)
-        similar_media, error = await self.tmdb_client.make_parallel_media_request(path='similar', medias=top_media)
+    async def aggregate_details_for_discover(self, user_id: str):
+        """
+        Have Mongo count the 6 most common details of the rated media so only those reach us.
+        Returns the details and the id and rating of every rated media.
+        """
+        facets, error = await self.mongo_client.make_request(
+            collection=self.config.RATED_COLLECTION, query=self.details_query_build(user_id, self.config.ID_KEY))
         if error:
-            print("Error attempting to get similar movies")
+            return None, error
+
+        details = tuple([(item['_id'], item['count']) for item in facets[0][detail]]
+                        for detail in ('directors', 'genres', 'keywords', 'networks'))
+        return (details, facets[0]['rated']), None
+
+    async def save_taste_profile(self, profile: TasteProfile):
+        return await self.profile_collection.replace_one({'user_id': profile.user_id}, profile.deconstruct(),
+                                                         upsert=True)
+
+    async def gather_sources(self, requests: dict, partial: bool = None, medias: list = None):
+        """
+        Await the TMDB requests of every source concurrently and route the results back to their source.
+        Sources without a request are returned empty. A source with any failed request is an error, in partial mode
+        it is listed in missing_sources instead and scored with the responses that did arrive. Only failing every
+        source entirely is an error in partial mode.
+        The similar and recommended results are also returned per media in media_results, keyed by the id of the
+        media in `medias` they were requested for.
+        """
+        if partial is None:
+            partial = self.config.RECC_PARTIAL_RESULTS
+        responses = await asyncio.gather(*requests.values())
+        collections = {source: [] for source in self.CANDIDATE_SOURCES}
+        collections['missing_sources'] = []
+        collections['media_results'] = {}
+        failed_sources = 0
+        for source, (response, error) in zip(requests, responses):
+            if error:
+                print(f"Error attempting to get {source} from TMDB")
+                if not partial:
+                    return None, RecommendationException
+                collections['missing_sources'].append(source)
+                failed_sources += 1
+                continue
+            failed = self.failed_requests(response)
+            if failed:
+                print(f"{failed} requests of {source} could not be fetched from TMDB")
+                if not partial:
+                    return None, RecommendationException
+                collections['missing_sources'].append(source)
+            for item in response:
+                if item is not None:
+                    collections[source].extend(item['results'])
+            if medias is not None and source in self.MEDIA_SOURCES:
+                for media, item in zip(medias, response):
+                    if item is not None:
+                        collections['media_results'].setdefault(self.media_key(media), {})[source] = item['results']
+
+        if requests and failed_sources == len(requests):
+            print("Unable to get any source from TMDB")
             return None, RecommendationException
+        if collections['missing_sources']:
+            print(f"Scoring without the failed requests of the sources: {collections['missing_sources']}")
+
+        return collections, None
+
+    @staticmethod
+    def failed_requests(response: list) -> int:
+        """
+        Number of the TMDB requests behind a make_parallel_*_request response that failed: a media response is None
+        when its request failed, a discover response counts its failed pages
+        """
+        return sum(1 if item is None else item.get('failed', 0) for item in response)
 
-        similar_media_collection = []
-        for item in similar_media:
-            similar_media_collection.extend(item['results'])
+    def media_key(self, media: dict) -> str:
+        # Mongo document keys are strings
+        return str(media[self.config.ID_KEY])
 
-        recommended_media, error = await self.tmdb_client.make_parallel_media_request(path='recommendations',
-                                                                                      medias=top_media)
+    def media_sources(self, top_media: list, media_results: dict) -> dict:
+        """
+        Build the similar and recommended sources from the results of every top rated media, in the order of
+        top_media the same as a full recompute requests them
+        """
+        sources = {source: [] for source in self.MEDIA_SOURCES}
+        for media in top_media:
+            results = media_results.get(self.media_key(media), {})
+            for source in self.MEDIA_SOURCES:
+                sources[source].extend(results.get(source, []))
+
+        return sources
+
+    async def save_calc_state(self, user_id: str, tmdb_data: ReccInput):
+        """
+        Store the calculation state (most common details and candidate set) used to generate a users
+        recommendations so later ratings can be applied incrementally. The similar and recommended results are
+        stored per top rated media so the results of a media that is no longer top rated can be dropped.
+        """
+        state = {'user_id': user_id,
+                 'directors': tmdb_data['directors'],
+                 'genres': tmdb_data['genres'],
+                 'keywords': tmdb_data['keywords'],
+                 'networks': tmdb_data['networks'],
+                 'media_results': tmdb_data['media_results'],
+                 'incremental_updates': tmdb_data.get('incremental_updates', 0)}
+        for source in self.CANDIDATE_SOURCES:
+            if source not in self.MEDIA_SOURCES:
+                state[source] = tmdb_data[source]
+
+        return await self.state_collection.update_one({'user_id': user_id},
+                                                      {'$set': state, '$currentDate': {'updatedAt': True}},
+                                                      upsert=True)
+
+    async def gather_incremental_reccs_data(self, user_id: str):
+        """
+        Rebuild the recommendation data from the stored calculation state and the users taste profile.
+        Only the similar and recommended media of newly top rated media are requested from TMDB, the results of
+        media that are no longer top rated are dropped.
+        Returns None when the change can not be applied incrementally and a full recompute is needed.
+        """
+        state = await self.state_collection.find_one({'user_id': user_id})
+        if not state or 'media_results' not in state:
+            print(f"No calculation state stored for user {user_id}")
+            return None, None
+        if state.get('incremental_updates', 0) >= self.config.RECC_MAX_INCREMENTAL_UPDATES:
+            print(f"Reached {self.config.RECC_MAX_INCREMENTAL_UPDATES} incremental updates for user {user_id}")
+            return None, None
+
+        profile, error = await self.load_taste_profile(user_id)
         if error:
-            print("Error attempting to get recommended movies")
             return None, RecommendationException
-        recommended_movie_collection = []
-        for item in recommended_media:
-            recommended_movie_collection.extend(item['results'])
-
-        full_response = {'discover_directors': discover_directors, 'discover_genres': discover_genres,
-                         'discover_keywords': discover_keywords, 'discover_networks': discover_networks,
-                         'similar_movies': similar_media_collection,
-                         'recommeded_movies': recommended_movie_collection,
-                         'rated_movies': rated_media,
-                         'directors': directors,
-                         'keywords': keywords,
-                         'networks': networks,
-                         'genres': genres}
-
-        return JSONEncoder().encode(full_response), error
+
+        previous_details = (state['directors'], state['genres'], state['keywords'], state['networks'])
+        directors, genres, keywords, networks = self.most_common_details(*profile.counters())
+        for previous, current in zip(previous_details, (directors, genres, keywords, networks)):
+            if [item[0] for item in previous] != [item[0] for item in current]:
+                # The discover queries or the order their results are merged in would change, so every discover
+                # request has to be made again
+                print("Most common details changed. Unable to update recommendations incrementally")
+                return None, None
+
+        top_media = self.get_top_rated_media(profile.rated_media(self.config.ID_KEY))
+        top_keys = {self.media_key(media) for media in top_media}
+        media_results = {key: results for key, results in state['media_results'].items() if key in top_keys}
+        if len(media_results) < len(state['media_results']):
+            print(f"Dropping the similar and recommended media of "
+                  f"{len(state['media_results']) - len(media_results)} media that are no longer top rated")
+        new_top_media = [media for media in top_media if self.media_key(media) not in media_results]
+
+        if new_top_media:
+            print(f"Requesting similar and recommended media for {len(new_top_media)} newly top rated media")
+            # The state is built on, so a source missing here would stay missing until the next full recompute
+            collections, error = await self.gather_sources({
+                'similar_movies': self.tmdb_client.make_parallel_media_request(path='similar',
+                                                                               medias=new_top_media),
+                'recommeded_movies': self.tmdb_client.make_parallel_media_request(path='recommendations',
+                                                                                  medias=new_top_media)},
+                partial=False, medias=new_top_media)
+            if error:
+                return None, RecommendationException
+            media_results.update(collections['media_results'])
+
+        tmdb_data: ReccInput = {source: state[source] for source in self.CANDIDATE_SOURCES
+                                if source not in self.MEDIA_SOURCES}
+        tmdb_data.update(self.media_sources(top_media, media_results))
+        tmdb_data.update({'rated_movies': [{self.config.ID_KEY: media_id} for media_id in profile.ratings],
+                          'directors': directors,
+                          'keywords': keywords,
+                          'networks': networks,
+                          'genres': genres,
+                          'top_media': top_media,
+                          'media_results': media_results,
+                          'incremental_updates': state.get('incremental_updates', 0) + 1})
+
+        return tmdb_data, None
+
+    async def clear_calc_state(self, user_id: str):
+        """
+        Remove the calculation state of a user so their next update is a full recompute
+        """
+        return await self.state_collection.delete_one({'user_id': user_id})
 
     def get_top_rated_media(self, rated_media: dict):
         """
@@ -187,54 +440,43 @@ class RecommendationsHelper:
         """
         Function to get relevant details from my existing rated movies for discover query
         """
+        return RecommendationsHelper.most_common_details(
+            *RecommendationsHelper.count_details_for_discover(rated_media))
 
-        genres = []
-        directors = []
-        keywords = []
-        networks = []
+    @staticmethod
+    def count_details_for_discover(rated_media: dict):
+        """
+        Function to count the directors, genre combinations, keywords and networks across the rated media
+        """
+        direc_counts = Counter()
+        genre_counts = Counter()
+        keyword_counts = Counter()
+        network_counts = Counter()
         for item in rated_media:
-            genres.append(item['genres'])
-            directors.append(item['director'])
-            keywords.append(item['keywords'])
-            # Networks are TV specific
-            if 'networks' in item:
-                networks.append(item['networks']['id'])
-
-        direc_counts = Counter(directors)
-        most_common_direcs = direc_counts.most_common(6)
-
-        network_counts = Counter(networks)
-        most_common_networks = network_counts.most_common(6)
+            count_media_details(item, direc_counts, genre_counts, keyword_counts, network_counts)
 
-        list_of_g_ids = []
-        for genre in genres:
-            genre_string = ''
-            for item in genre:
-                genre_string += str(item['id'])
-                if item != genre[-1]:
-                    genre_string += ','
-            list_of_g_ids.append(genre_string)
-
-        genre_counts = Counter(list_of_g_ids)
-
-        list_of_keyword_sets = []
-        for keyword_set in keywords:
-            for keyword in keyword_set:
-                list_of_keyword_sets.append(keyword['id'])
-
-        keyword_counts = Counter(list_of_keyword_sets)
+        return direc_counts, genre_counts, keyword_counts, network_counts
 
+    @staticmethod
+    def most_common_details(direc_counts: Counter, genre_counts: Counter, keyword_counts: Counter,
+                            network_counts: Counter):
+        """
+        Function to get the 6 most common of each detail used for the discover queries
+        """
+        most_common_direcs = direc_counts.most_common(6)
         most_common_genres = genre_counts.most_common(6)
         most_common_keywords = keyword_counts.most_common(6)
+        most_common_networks = network_counts.most_common(6)
 
         return most_common_direcs, most_common_genres, most_common_keywords, most_common_networks
 
-    async def query_mongo_for_user(self, user_id, collection):
+    async def query_mongo_for_user(self, user_id, collection, query: list = None):
         """
         Function to get info from a given collection from a given user
         """
         try:
-            query = self.media_query_build(user_id)
+            if query is None:
+                query = self.media_query_build(user_id)
             print(collection)
             print(query)
             rated_movies, error = await self.mongo_client.make_request(collection=collection, query=query)
@@ -245,12 +487,12 @@ class RecommendationsHelper:
 
         return rated_movies, error
 
-    async def most_recent_rated_media(self, user_id):
+    async def most_recent_rated_media(self, user_id, projection: dict = None, limit: int = None):
         """
         Function to query mongo to get the most recent rated movie
         """
         try:
-            query = self.recent_media_query(user_id)
+            query = self.recent_media_query(user_id, projection=projection, limit=limit)
             rated_movies, error = await self.mongo_client.make_request(collection=self.config.RATED_COLLECTION,
                                                                        query=query)
         except Exception as err:
@@ -260,8 +502,41 @@ class RecommendationsHelper:
 
         return rated_movies, error
 
+    async def latest_rated_update(self, user_id):
+        """
+        Function to get when the user last rated or updated a media, None when they have not rated any.
+        Only the timestamp of the most recent rated media is returned, served by the user_id/updatedAt index.
+        """
+        recent_media, error = await self.most_recent_rated_media(user_id, projection={'_id': 0, 'updatedAt': 1},
+                                                                 limit=1)
+        if error:
+            return None, error
+        if not recent_media:
+            return None, None
+
+        return recent_media[0]['updatedAt'], None
+
+    def rated_media_projection(self) -> dict:
+        """
+        Fields of the rated media needed to build the taste profile
+        """
+        return {'_id': 0, self.config.ID_KEY: 1, 'rating': 1, 'updatedAt': 1, 'director': 1, 'genres.id': 1,
+                'keywords.id': 1, 'networks.id': 1}
+
+    @staticmethod
+    def shape_query(pipeline: list, projection: dict = None, limit: int = None) -> list:
+        """
+        Function to add a $limit and a $project stage to the end of a query
+        """
+        if limit:
+            pipeline.append({"$limit": limit})
+        if projection:
+            pipeline.append({"$project": projection})
+
+        return pipeline
+
     @staticmethod
-    def recent_media_query(user_id) -> list:
+    def recent_media_query(user_id, projection: dict = None, limit: int = None) -> list:
         """
         Function to build out the query to get most recent rated movie
         """
@@ -279,10 +554,10 @@ class RecommendationsHelper:
             }
         ]
 
-        return pipeline
+        return RecommendationsHelper.shape_query(pipeline, projection=projection, limit=limit)
 
     @staticmethod
-    def media_query_build(user_id) -> list:
+    def media_query_build(user_id, projection: dict = None, limit: int = None) -> list:
         """
         Function to build out the query to get rated movies
         """
@@ -295,4 +570,95 @@ class RecommendationsHelper:
             }
         ]
 
+        return RecommendationsHelper.shape_query(pipeline, projection=projection, limit=limit)
+
+    @staticmethod
+    def details_query_build(user_id, id_key: str, limit: int = 6) -> list:
+        """
+        Function to build out the query to count the most common details of the rated media.
+        Ties are ordered by the first rated media with the detail, the same as Counter.most_common. For keywords that
+        is the first rated media and then the position of the keyword in it.
+        The rated facet still returns the id and rating of every rated media: every rated media is removed from the
+        candidates and the ratings pick the top rated media, so only the other fields are left out.
+        """
+
+        def most_common(key, first="$_id") -> list:
+            return [
+                {
+                    "$group": {
+                        "_id": key,
+                        "count": {"$sum": 1},
+                        # Keywords compare {media, index} documents, which Mongo orders field by field
+                        "first": {"$min": first}
+                    }
+                },
+                {
+                    "$sort": {
+                        "count": -1,
+                        "first": 1
+                    }
+                },
+                {
+                    "$limit": limit
+                },
+                {
+                    "$project": {
+                        "first": 0
+                    }
+                }
+            ]
+
+        # Same format as taste_profile.genre_string, e.g. "18,80"
+        genre_key = {
+            "$reduce": {
+                "input": "$genres",
+                "initialValue": "",
+                "in": {
+                    "$concat": ["$$value", {"$cond": [{"$eq": ["$$value", ""]}, "", ","]},
+                                {"$toString": "$$this.id"}]
+                }
+            }
+        }
+
+        pipeline = [
+            {
+                "$match": {
+                    "user_id": user_id
+                }
+            },
+            {
+                "$facet": {
+                    "directors": most_common("$director"),
+                    "genres": most_common(genre_key),
+                    "keywords": [{"$unwind": {"path": "$keywords", "includeArrayIndex": "keyword_index"}}] +
+                    most_common("$keywords.id", first={"media": "$_id", "index": "$keyword_index"}),
+                    # Networks are TV specific
+                    "networks": [{"$match": {"networks": {"$exists": True}}}] + most_common("$networks.id"),
+                    "rated": [{"$project": {"_id": 0, id_key: 1, "rating": 1}}]
+                }
+            }
+        ]
+
         return pipeline
+
+    @staticmethod
+    def updated_media_query(user_id, since, projection: dict = None) -> list:
+        """
+        Function to build out the query to get media rated or updated after a given time
+        """
+
+        pipeline = [
+            {
+                "$match": {
+                    "user_id": user_id,
+                    "updatedAt": {"$gt": since}
+                }
+            },
+            {
+                "$sort": {
+                    "updatedAt": 1
+                }
+            }
+        ]
+
+        return RecommendationsHelper.shape_query(pipeline, projection=projection)
@@ -0,0 +1,127 @@
+"""
+In-process cache of TMDB responses
+
+Discover, similar and recommendation results change slowly and are requested for many users, so TmdbClient.get keeps
+the raw response bodies in a process wide ResponseCache:
+
+    key         -> the normalized url, so the same request made with a different parameter order is one entry
+    ttl         -> seconds an entry is served for, per endpoint (discover, similar, recommendations, media)
+    eviction    -> least recently used entries are evicted once there are more than max_entries entries or their
+                   bodies add up to more than max_bytes
+
+Hits, misses and evictions are counted on the cache and in prometheus.
+"""
+
+import re
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+from prometheus_client import Counter
+
+CACHE_EVENTS = Counter('tmdb_response_cache_events', 'TMDB response cache hits, misses and evictions',
+                       labelnames=['endpoint', 'event'])
+
+
+def normalize_url(url: str) -> str:
+    """
+    Function to normalize a url: duplicate slashes are collapsed and the query parameters sorted
+    """
+    parts = urlsplit(url)
+    path = re.sub('/+', '/', parts.path)
+    query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+    return urlunsplit((parts.scheme, parts.netloc.lower(), path, query, ''))
+
+
+def endpoint_of(url: str) -> str:
+    """
+    Function to get the endpoint a TMDB url belongs to, used to pick its TTL
+    """
+    segments = [segment for segment in urlsplit(url).path.split('/') if segment]
+    if 'discover' in segments:
+        return 'discover'
+    if segments and segments[-1] in ('similar', 'recommendations'):
+        return segments[-1]
+    return 'media'
+
+
+def parse_ttls(ttls: str) -> dict:
+    """
+    Function to parse endpoint TTLs written as 'discover=3600,similar=86400'
+    """
+    parsed = {}
+    for item in filter(None, (item.strip() for item in (ttls or '').split(','))):
+        endpoint, seconds = item.split('=')
+        parsed[endpoint.strip()] = float(seconds)
+    return parsed
+
+
+class ResponseCache:
+
+    def __init__(self, max_entries: int, max_bytes: int, ttls: dict, default_ttl: float = 3600) -> None:
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttls = ttls
+        self.default_ttl = default_ttl
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # Flask runs every request on its own thread and event loop
+        self.lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def enabled(self) -> bool:
+        return self.max_entries > 0 and self.max_bytes > 0
+
+    def get(self, url: str):
+        """
+        Function to get the cached body of a url, None when it is not cached or expired
+        """
+        if not self.enabled():
+            return None
+        key = normalize_url(url)
+        endpoint = endpoint_of(key)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] <= time.monotonic():
+                self.remove(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                CACHE_EVENTS.labels(endpoint=endpoint, event='miss').inc()
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+        CACHE_EVENTS.labels(endpoint=endpoint, event='hit').inc()
+        return entry[1]
+
+    def put(self, url: str, body: bytes):
+        if not self.enabled() or len(body) > self.max_bytes:
+            return
+        key = normalize_url(url)
+        endpoint = endpoint_of(key)
+        ttl = self.ttls.get(endpoint, self.default_ttl)
+        if ttl <= 0:
+            return
+        with self.lock:
+            if key in self.entries:
+                self.remove(key)
+            self.entries[key] = (time.monotonic() + ttl, body)
+            self.size += len(body)
+            while len(self.entries) > self.max_entries or self.size > self.max_bytes:
+                evicted, (_, evicted_body) = self.entries.popitem(last=False)
+                self.size -= len(evicted_body)
+                self.evictions += 1
+                CACHE_EVENTS.labels(endpoint=endpoint_of(evicted), event='eviction').inc()
+
+    def remove(self, key: str):
+        _, body = self.entries.pop(key)
+        self.size -= len(body)
+
+    def stats(self) -> dict:
+        return {'entries': len(self.entries), 'bytes': self.size, 'hits': self.hits, 'misses': self.misses,
+                'evictions': self.evictions}
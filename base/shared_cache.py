@@ -0,0 +1,99 @@
+"""
+Shared TMDB response cache stored in Mongo
+
+The in-process ResponseCache is lost on every restart and is not shared between the gunicorn workers and the
+consumer. SharedResponseCache is the tier behind it, a collection with one document per normalized url:
+
+    _id             -> the normalized url
+    body            -> the raw response body
+    fresh_until     -> until when the body is served as is
+    expireAt        -> when Mongo removes the document (TTL index), stale_seconds after fresh_until
+
+Between fresh_until and expireAt a body is stale: it is still served, and TmdbClient refreshes it in the background
+(stale-while-revalidate). get_many looks up every url of a fan out with a single $in query.
+
+The TTL index on expireAt is created by the first write of every process, so documents expire whichever service
+stores them.
+"""
+
+import datetime
+from pymongo import ASCENDING, UpdateOne
+from base.response_cache import endpoint_of, normalize_url
+
+
+def utc_now() -> datetime.datetime:
+    # pymongo returns naive UTC datetimes
+    return datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+
+
+# Collections whose TTL index was created by this process
+indexed_collections = set()
+
+
+class SharedResponseCache:
+
+    def __init__(self, collection, ttls: dict, stale_seconds: float, default_ttl: float = 3600) -> None:
+        self.collection = collection
+        self.ttls = ttls
+        self.stale_seconds = stale_seconds
+        self.default_ttl = default_ttl
+
+    async def get_many(self, urls: list):
+        """
+        Function to look up many urls at once. Returns url -> (body, stale) for the urls that are cached.
+        """
+        keys = {normalize_url(url): url for url in urls}
+        cached = {}
+        try:
+            now = utc_now()
+            async for doc in self.collection.find({'_id': {'$in': list(keys)}}):
+                cached[keys[doc['_id']]] = (doc['body'], doc['fresh_until'] <= now)
+        except Exception as error:
+            print(f"Error attempting to read the shared TMDB cache: {error}")
+            return {}, error
+
+        return cached, None
+
+    async def ensure_index(self):
+        """
+        Function to create the TTL index that removes the documents at expireAt, once per process
+        """
+        name = self.collection.full_name
+        if name in indexed_collections:
+            return None
+        try:
+            await self.collection.create_index([('expireAt', ASCENDING)], expireAfterSeconds=0)
+        except Exception as error:
+            print(f"Error attempting to create the shared TMDB cache index: {error}")
+            return error
+
+        indexed_collections.add(name)
+        return None
+
+    async def put_many(self, bodies: dict):
+        """
+        Function to store many url -> body responses with a single bulk write
+        """
+        now = utc_now()
+        operations = []
+        for url, body in bodies.items():
+            key = normalize_url(url)
+            ttl = self.ttls.get(endpoint_of(key), self.default_ttl)
+            if ttl <= 0:
+                continue
+            fresh_until = now + datetime.timedelta(seconds=ttl)
+            operations.append(UpdateOne({'_id': key},
+                                        {'$set': {'body': body, 'fresh_until': fresh_until,
+                                                  'expireAt': fresh_until + datetime.timedelta(
+                                                      seconds=self.stale_seconds)}},
+                                        upsert=True))
+        if not operations:
+            return None
+        await self.ensure_index()
+        try:
+            await self.collection.bulk_write(operations, ordered=False)
+        except Exception as error:
+            print(f"Error attempting to write the shared TMDB cache: {error}")
+            return error
+
+        return None
@@ -0,0 +1,133 @@
+"""
+Streaming variant of the ReccCalculator
+
+The ReccCalculator waits for every TMDB response before merging the sources. The StreamingReccCalculator consumes
+RecommendationsHelper.stream_reccs_data instead and folds every batch of discovered media into running weights as
+the responses arrive, so scoring overlaps the network waits and the raw responses can be dropped once folded.
+
+The results are the same as the ReccCalculator: every media is given the rank (source, request, position) it would
+have in merge_sources. The occurrence with the lowest rank is the one kept, and the candidates are ordered by rank
+when the weights are summed, so the kept tags, the float addition order and the order of ties all match.
+"""
+
+import time
+from collections import Counter
+from base.candidates import Candidate, display_info
+from base.metrics import StageTimings
+from base.recc_calculator import ReccCalculator
+from base.recc_data import ReccInput
+
+# Order the sources are merged in by ReccCalculator.merge_sources
+SOURCE_ORDER = {source: rank for rank, source in enumerate(('discover_genres', 'discover_keywords',
+                                                            'discover_directors', 'discover_networks',
+                                                            'similar_movies', 'recommeded_movies'))}
+
+
+class StreamingCalculation:
+    """
+    Running state of a streamed calculation for a single user
+    """
+
+    def __init__(self, tmdb_data: ReccInput, id_key: str, tv: bool, display_fields: tuple) -> None:
+        self.display_fields = display_fields
+        self.rated_ids = {item[id_key] for item in tmdb_data['rated_movies']}
+        self.genre_ids = set()
+        for genre in tmdb_data['genres']:
+            self.genre_ids.update(genre[0].split(','))
+        self.director_weights = ReccCalculator.weight_lookup(tmdb_data['directors'])
+        self.keyword_weights = ReccCalculator.weight_lookup(tmdb_data['keywords'])
+        self.network_weights = ReccCalculator.weight_lookup(tmdb_data['networks']) if tv else None
+
+        self.counts = Counter()
+        self.ranks = {}
+        self.candidates = {}
+        self.info = {}
+        # Genre and vote weights only depend on the media, tag weights on the occurrence that is kept
+        self.media_weights = {}
+        self.tag_weights = {}
+
+    def __len__(self) -> int:
+        return len(self.candidates)
+
+    def fold(self, source: str, index: int, results: list):
+        """
+        Function to fold the results of one TMDB response into the running weights
+        """
+        source_rank = SOURCE_ORDER[source]
+        for position, media in enumerate(results):
+            media_id = media['id']
+            if media_id in self.rated_ids:
+                continue
+            self.counts[media_id] += 1
+            rank = (source_rank, index, position)
+            if media_id in self.ranks and self.ranks[media_id] <= rank:
+                continue
+
+            candidate = Candidate(media)
+            if media_id not in self.ranks:
+                genre_weight = sum(1 for genre in candidate.genre_ids if str(genre) in self.genre_ids)
+                self.media_weights[media_id] = (genre_weight, round(candidate.vote_average, 3))
+            self.ranks[media_id] = rank
+            self.candidates[media_id] = candidate
+            self.info[media_id] = display_info(media, self.display_fields)
+            self.tag_weights[media_id] = self.tag_weight(candidate)
+
+    def tag_weight(self, candidate: Candidate) -> tuple:
+        """
+        Function to get the director, network and keyword weights of a candidate, None when it has none
+        """
+        director = self.director_weights.get(candidate.director) if candidate.director is not None else None
+        network = None
+        if self.network_weights is not None and candidate.networks is not None:
+            network = self.network_weights.get(candidate.networks)
+        keyword = self.keyword_weights.get(candidate.keywords) if candidate.keywords is not None else None
+        return director, network, keyword
+
+    def weights(self) -> Counter:
+        """
+        Function to sum the running weights, adding them in the same order as the ReccCalculator stages
+        """
+        media_weights = Counter()
+        for media_id in sorted(self.ranks, key=self.ranks.get):
+            genre_weight, vote_weight = self.media_weights[media_id]
+            weight = self.counts[media_id] + genre_weight
+            weight += vote_weight
+            for tag_weight in self.tag_weights[media_id]:
+                if tag_weight is not None:
+                    weight += tag_weight
+            media_weights[media_id] = weight
+
+        return media_weights
+
+
+class StreamingReccCalculator(ReccCalculator):
+
+    def start(self, tmdb_data: ReccInput) -> StreamingCalculation:
+        return StreamingCalculation(tmdb_data, id_key=self.config.ID_KEY, tv=self.config.NODE_ENV == 'tv',
+                                    display_fields=self.config.RECC_DISPLAY_FIELDS)
+
+    async def calculate_stream(self, tmdb_data: ReccInput, batches) -> tuple:
+        '''
+            Function that generates the recommendations for a user from an async iterator of
+            (source, index, results) batches. tmdb_data only needs the rated media and the most common details.
+            Returns the recommendations and the timings of the fold and format stages.
+        '''
+        timings = StageTimings()
+        sinks = [timings] + self.metrics_sinks
+        calculation = self.start(tmdb_data)
+
+        fold_seconds = 0
+        async for source, index, results in batches:
+            start = time.perf_counter()
+            calculation.fold(source, index, results)
+            fold_seconds += time.perf_counter() - start
+
+        start = time.perf_counter()
+        results = self.format_results(media_weights=calculation.weights(), media_index=calculation.info)
+        format_seconds = time.perf_counter() - start
+
+        for sink in sinks:
+            sink.observe(stage='fold', seconds=fold_seconds, candidates=len(calculation))
+            sink.observe(stage='format', seconds=format_seconds, candidates=len(results))
+
+        return results, timings.deconstruct()
@@ -0,0 +1,91 @@
+"""
+Per user taste profile persisted next to the rated media
+
+The profile holds the detail counters the discover queries are built from and the rating of every rated media:
+
+    directors   -> rated media per director
+    genres      -> rated media per genre combination (see genre_string)
+    keywords    -> rated media per keyword
+    networks    -> rated media per network, TV only
+    ratings     -> media id -> rating, in the order the media were rated
+
+synced_at is the updatedAt of the most recent rating applied to the profile. Only the ratings updated after it have
+to be read and applied, so the profile is read from Mongo in one point read instead of counting every rated media.
+The counters are stored as (id, count) pairs as not every id is a valid Mongo key.
+"""
+
+from collections import Counter
+
+
+def genre_string(genre: list) -> str:
+    genres = ''
+    for item in genre:
+        genres += str(item['id'])
+        if item != genre[-1]:
+            genres += ','
+    return genres
+
+
+def count_media_details(item: dict, direc_counts: Counter, genre_counts: Counter, keyword_counts: Counter,
+                        network_counts: Counter):
+    """
+    Function to add a single rated media to the detail counters
+    """
+    direc_counts[item['director']] += 1
+    genre_counts[genre_string(item['genres'])] += 1
+    for keyword in item['keywords']:
+        keyword_counts[keyword['id']] += 1
+    # Networks are TV specific
+    if 'networks' in item:
+        network_counts[item['networks']['id']] += 1
+
+
+class TasteProfile:
+
+    def __init__(self, user_id: str = '') -> None:
+        self.user_id = user_id
+        self.directors = Counter()
+        self.genres = Counter()
+        self.keywords = Counter()
+        self.networks = Counter()
+        self.ratings = {}
+        self.synced_at = None
+
+    def counters(self) -> tuple:
+        return self.directors, self.genres, self.keywords, self.networks
+
+    def apply(self, media: dict, id_key: str):
+        """
+        Function to apply a rated media to the profile. A changed rating only updates the rating, the details of
+        the media are already counted.
+        """
+        media_id = media[id_key]
+        if media_id not in self.ratings:
+            count_media_details(media, *self.counters())
+        self.ratings[media_id] = media['rating']
+        updated_at = media.get('updatedAt')
+        if updated_at is not None and (self.synced_at is None or updated_at > self.synced_at):
+            self.synced_at = updated_at
+
+    def rated_media(self, id_key: str) -> list:
+        return [{id_key: media_id, 'rating': rating} for media_id, rating in self.ratings.items()]
+
+    def deconstruct(self) -> dict:
+        return {'user_id': self.user_id,
+                'directors': list(self.directors.items()),
+                'genres': list(self.genres.items()),
+                'keywords': list(self.keywords.items()),
+                'networks': list(self.networks.items()),
+                'ratings': list(self.ratings.items()),
+                'synced_at': self.synced_at}
+
+    @staticmethod
+    def reconstruct(a_dict: dict):
+        profile = TasteProfile(user_id=a_dict['user_id'])
+        profile.directors = Counter(dict(a_dict['directors']))
+        profile.genres = Counter(dict(a_dict['genres']))
+        profile.keywords = Counter(dict(a_dict['keywords']))
+        profile.networks = Counter(dict(a_dict['networks']))
+        profile.ratings = dict(a_dict['ratings'])
+        profile.synced_at = a_dict.get('synced_at')
+        return profile
@@ -1,27 +1,146 @@
-import requests
 import json
+import time
+import weakref
+from urllib.parse import urlencode
 from env_config import Config
+from base.latency import LatencyTracker
+from base.mongoclient import MongoClient
+from base.rate_limiter import RateLimiter, backoff_seconds, parse_retry_after
+from base.response_cache import ResponseCache, normalize_url, parse_ttls
+from base.shared_cache import SharedResponseCache
 import asyncio
 import aiohttp
 
+# One pooled session per event loop, shared by every TmdbClient running on that loop
+sessions = weakref.WeakKeyDictionary()
+
+
+def get_session(config: Config) -> aiohttp.ClientSession:
+    """
+    Function to get the session of the running event loop, creating it on first use
+    """
+    loop = asyncio.get_running_loop()
+    session = sessions.get(loop)
+    if session is None or session.closed:
+        connector = aiohttp.TCPConnector(limit=config.TMDB_CONNECTION_LIMIT,
+                                         keepalive_timeout=config.TMDB_KEEPALIVE_SECONDS,
+                                         ttl_dns_cache=config.TMDB_DNS_CACHE_SECONDS)
+        session = aiohttp.ClientSession(connector=connector)
+        sessions[loop] = session
+    return session
+
+
+# Requests in flight on each event loop by normalized url, so concurrent callers share a single request
+in_flight = weakref.WeakKeyDictionary()
+
+# Process wide cache of TMDB responses, created with the first client
+response_cache = None
+
+
+def get_response_cache(config: Config) -> ResponseCache:
+    global response_cache
+    if response_cache is None:
+        response_cache = ResponseCache(max_entries=config.TMDB_CACHE_MAX_ENTRIES,
+                                       max_bytes=config.TMDB_CACHE_MAX_BYTES,
+                                       ttls=parse_ttls(config.TMDB_CACHE_TTLS))
+    return response_cache
+
+
+# Process wide TMDB rate limiter, created with the first client
+rate_limiter = None
+
+
+def get_rate_limiter(config: Config) -> RateLimiter:
+    global rate_limiter
+    if rate_limiter is None:
+        rate_limiter = RateLimiter(rate=config.TMDB_RATE_LIMIT, burst=config.TMDB_RATE_BURST,
+                                   max_concurrency=config.TMDB_MAX_CONCURRENCY)
+    return rate_limiter
+
+
+# Process wide latency of the successful TMDB requests, used to hedge slow requests
+latency_tracker = None
+
+
+def get_latency_tracker(config: Config) -> LatencyTracker:
+    global latency_tracker
+    if latency_tracker is None:
+        latency_tracker = LatencyTracker(percentile=config.TMDB_HEDGE_PERCENTILE)
+    return latency_tracker
+
+
+# Background tasks of each event loop: refreshes of stale shared cache entries and shared cache writes
+background_tasks = weakref.WeakKeyDictionary()
+
+
+def run_in_background(coro) -> asyncio.Task:
+    """
+    Function to run a coroutine on the running event loop without waiting for it. close_session waits for it.
+    """
+    loop = asyncio.get_running_loop()
+    task = loop.create_task(coro)
+    tasks = background_tasks.setdefault(loop, set())
+    tasks.add(task)
+    task.add_done_callback(tasks.discard)
+    return task
+
+
+async def close_session():
+    """
+    Function to close the session of the running event loop. Event loops that are torn down after one request, like
+    the loop of every async Flask view, would cancel their background tasks, so they are given up to
+    TMDB_BACKGROUND_DRAIN_SECONDS to finish first.
+    """
+    loop = asyncio.get_running_loop()
+    tasks = background_tasks.pop(loop, None)
+    if tasks:
+        _, pending = await asyncio.wait(tasks, timeout=Config().TMDB_BACKGROUND_DRAIN_SECONDS or None)
+        if pending:
+            print(f"Cancelling {len(pending)} TMDB background tasks still running as the event loop closes")
+            for task in pending:
+                task.cancel()
+
+    session = sessions.pop(loop, None)
+    if session is not None:
+        await session.close()
+
 
 class TmdbClient:
     """
     A generic tmdb client
     """
 
-    def __init__(self) -> None:
+    def __init__(self, mongo_client: MongoClient = None) -> None:
         self.config = Config()
         self.api_key = self.config.TMDB_API
         self.read_token = self.config.TMDB_READ_TOKEN
-        self.api_endpoint = 'https://api.themoviedb.org/3/'
+        self.api_endpoint = self.config.TMDB_API_URL
+        # Shared by every client in the process so bursts of recomputes stay under the TMDB limits
+        self.limiter = get_rate_limiter(self.config)
+        self.latency = get_latency_tracker(self.config)
+        self.result_fields = self.config.TMDB_RESULT_FIELDS
+        self.timeout = aiohttp.ClientTimeout(total=self.config.TMDB_REQUEST_TIMEOUT_SECONDS or None)
+        self.cache = get_response_cache(self.config)
+        # The shared cache uses the MongoClient of the owner. Clients created without one, e.g. for a ping, only use
+        # the in-process cache
+        self.shared_cache = None
+        if self.config.TMDB_SHARED_CACHE and mongo_client is not None:
+            self.shared_cache = SharedResponseCache(collection=mongo_client.tmdb_cache_collection(),
+                                                    ttls=parse_ttls(self.config.TMDB_CACHE_TTLS),
+                                                    stale_seconds=self.config.TMDB_SHARED_CACHE_STALE_SECONDS)
+        # Background refreshes of stale shared cache entries
+        self.revalidating = {}
+
+    def session(self) -> aiohttp.ClientSession:
+        return get_session(self.config)
 
     async def ping(self) -> bool:
         try:
             headers = {
                 'Authorization': f"Bearer {self.read_token}"
             }
-            requests.get(url=f"{self.api_endpoint}/account", headers=headers)
+            async with self.session().get(url=f"{self.api_endpoint}/account", headers=headers) as response:
+                await response.read()
             return "True", 200
         except Exception as error:
             print(f"Error talking to TMDB: {error}")
@@ -33,59 +152,254 @@ class TmdbClient:
         """
         print(f"Making request against media endpoint for media: {media_id}")
         try:
-            headers = {
-                'Authorization': f"Bearer {self.read_token}"
-            }
             print(
                 f"Url is: {self.api_endpoint}/{self.config.NODE_ENV}/{media_id}/{path}")
-            result = requests.get(url=f"{self.api_endpoint}/{self.config.NODE_ENV}/{media_id}/{path}",
-                                  headers=headers)
+            content, status = await self.fetch(f"{self.api_endpoint}/{self.config.NODE_ENV}/{media_id}/{path}")
         except Exception as error:
             print(f"Error attempting to make request against tmdb: {error}")
             return None, error
 
-        if result.status_code == 200:
+        if status == 200:
             print("Successfully got a response from generic media endpoint...")
             try:
-                return result.json(), None
+                return self.parse(content), None
             except json.decoder.JSONDecodeError as err:
                 print("Error with the response returned TMDB. Cleaning up")
                 return None, err
         else:
             print(
-                f"Unexpected response from TMDB. Status: {result.status_code}, content: {result.content}")
+                f"Unexpected response from TMDB. Status: {status}, content: {content}")
             return None, Exception
 
-    async def get(self, url, session):
+    async def get(self, url):
+        ret = await self.get_many([url])
+        return ret[0]
+
+    async def get_many(self, urls: list) -> list:
+        """
+        Function to get the body of every url, in order. The in-process cache is checked first, then the shared cache
+        with a single query, and only the urls left are requested from TMDB. Stale shared entries are served and
+        refreshed in the background, and the fetched responses are written to the shared cache in the background.
+        """
+        bodies = {}
+        for url in urls:
+            cached = self.cache.get(url)
+            if cached is not None:
+                bodies[url] = cached
+
+        missing = [url for url in dict.fromkeys(urls) if url not in bodies]
+        if missing and self.shared_cache is not None:
+            shared, _ = await self.shared_cache.get_many(missing)
+            for url, (body, stale) in shared.items():
+                bodies[url] = body
+                if stale:
+                    self.revalidate(url)
+                else:
+                    self.cache.put(url, body)
+            missing = [url for url in missing if url not in bodies]
+
+        if missing:
+            ret = await self.fetch_all(missing)
+            fetched = {}
+            for url, (body, status) in zip(missing, ret):
+                # Failed requests are returned as None
+                bodies[url] = body if status == 200 else None
+                if status == 200:
+                    fetched[url] = body
+            if fetched and self.shared_cache is not None:
+                run_in_background(self.shared_cache.put_many(fetched))
+
+        return [bodies[url] for url in urls]
+
+    async def fetch_all(self, urls: list) -> list:
+        """
+        Function to fetch every url within the fan out deadline. The urls still pending at the deadline are returned
+        as failed, their shared requests keep running and fill the cache for the next caller.
+        """
+        tasks = [asyncio.ensure_future(self.fetch(url)) for url in urls]
+        deadline = self.config.TMDB_FANOUT_DEADLINE_SECONDS or None
+        try:
+            done, pending = await asyncio.wait(tasks, timeout=deadline)
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+        if pending:
+            print(f"{len(pending)} of {len(urls)} TMDB requests missed the {deadline} second deadline")
+
+        return [task.result() if task in done else (None, None) for task in tasks]
+
+    async def fetch(self, url) -> tuple:
+        """
+        Function to request a url from TMDB. Returns the body and the status, 200 responses are cached in process.
+        A url already in flight on this event loop is not requested again, the caller waits on the same request.
+        Cancelling a caller does not cancel the request the other callers are waiting on.
+        """
+        flights = in_flight.setdefault(asyncio.get_running_loop(), {})
+        key = normalize_url(url)
+        flight = flights.get(key)
+        if flight is None:
+            flight = asyncio.ensure_future(self.request(url))
+            flights[key] = flight
+            flight.add_done_callback(lambda done: self.land(flights, key, done))
+
+        try:
+            return await asyncio.shield(flight)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print("Unable to get url {} due to {}.".format(url, e.__class__))
+            return None, None
+
+    @staticmethod
+    def land(flights: dict, key: str, flight: asyncio.Future):
+        if flights.get(key) is flight:
+            del flights[key]
+        # Retrieve the error so it is not reported as never retrieved when every caller was cancelled
+        if not flight.cancelled():
+            flight.exception()
+
+    async def request(self, url) -> tuple:
+        """
+        Function to request a url through the rate limiter. 429, 5xx and connection errors are retried with a jittered
+        backoff, or after the Retry-After of the response.
+        """
         headers = {
             'Authorization': f"Bearer {self.read_token}"
         }
-        try:
-            async with session.get(url=url, headers=headers) as response:
-                resp = await response.read()
+        for attempt in range(self.config.TMDB_MAX_RETRIES + 1):
+            resp, status, retry_after, error = await self.hedged_attempt(url, headers)
+
+            if self.answered(status):
                 print("Successfully got url {} with resp of length {}.".format(
                     url, len(resp)))
-                return resp
-        except Exception as e:
-            print("Unable to get url {} due to {}.".format(url, e.__class__))
+                if status == 200:
+                    self.cache.put(url, resp)
+                return resp, status
+
+            if attempt < self.config.TMDB_MAX_RETRIES:
+                wait = backoff_seconds(attempt, base=self.config.TMDB_RETRY_BASE_SECONDS,
+                                       cap=self.config.TMDB_RETRY_MAX_SECONDS, retry_after=retry_after)
+                print(f"Retrying url {url} in {wait:.2f} seconds. Status: {status}, error: {error}")
+                await asyncio.sleep(wait)
+
+        if error is not None:
+            raise error
+        return resp, status
+
+    @staticmethod
+    def answered(status) -> bool:
+        # 429 and 5xx responses are retried, any other response is the answer
+        return status is not None and status != 429 and status < 500
+
+    async def attempt(self, url, headers) -> tuple:
+        """
+        Function to make a single request through the rate limiter, within the per request timeout.
+        Returns the body, status, Retry-After and connection error.
+        """
+        resp = None
+        status = None
+        retry_after = None
+        error = None
+        await self.limiter.acquire()
+        start = time.monotonic()
+        try:
+            async with self.session().get(url=url, headers=headers, timeout=self.timeout) as response:
+                status = response.status
+                retry_after = parse_retry_after(response.headers.get('Retry-After'))
+                resp = await response.read()
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            error = e
+        finally:
+            await self.limiter.release(status=status, retry_after=retry_after)
+
+        if status == 200:
+            self.latency.observe(time.monotonic() - start)
+        return resp, status, retry_after, error
+
+    async def hedged_attempt(self, url, headers) -> tuple:
+        """
+        Function to make an attempt, sending a duplicate request when it takes longer than the hedge percentile of
+        the recent requests. The first answer is used and the other request is cancelled.
+        """
+        attempts = {asyncio.ensure_future(self.attempt(url, headers))}
+        try:
+            delay = self.latency.hedge_delay()
+            if delay is not None:
+                done, _ = await asyncio.wait(attempts, timeout=delay)
+                if not done:
+                    print(f"Hedging url {url} after {delay:.3f} seconds")
+                    attempts.add(asyncio.ensure_future(self.attempt(url, headers)))
+
+            while True:
+                done, attempts = await asyncio.wait(attempts, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    result = task.result()
+                    if self.answered(result[1]) or not attempts:
+                        return result
+        finally:
+            for task in attempts:
+                task.cancel()
+
+    def parse(self, body) -> dict:
+        """
+        Function to convert a response body from BYTES to JSON, keeping only the TMDB_RESULT_FIELDS of every result
+        so the rest of the payload is never held on to, stored with the recommendations or sent over RabbitMQ
+        """
+        payload = json.loads(body)
+        if self.result_fields and isinstance(payload, dict) and isinstance(payload.get('results'), list):
+            payload['results'] = [{field: media[field] for field in self.result_fields if field in media}
+                                  for media in payload['results']]
+        return payload
+
+    def load_bodies(self, urls: list, bodies: list) -> tuple:
+        """
+        Function to convert response bodies from BYTES to JSON. Failed requests are None and are logged, an error is
+        only returned when every request failed.
+        """
+        completed = []
+        for url, body in zip(urls, bodies):
+            try:
+                completed.append(self.parse(body) if body is not None else None)
+            except json.decoder.JSONDecodeError:
+                completed.append(None)
+            if completed[-1] is None:
+                print(f"No usable response from TMDB for url {url}. Skipping it")
+
+        if urls and all(item is None for item in completed):
+            return None, Exception
+        return completed, None
+
+    def revalidate(self, url):
+        """
+        Function to refresh a stale shared cache entry in the background
+        """
+        if url in self.revalidating:
+            return
+        task = run_in_background(self.refresh(url))
+        self.revalidating[url] = task
+        task.add_done_callback(lambda _: self.revalidating.pop(url, None))
+
+    async def refresh(self, url):
+        body, status = await self.fetch(url)
+        if status == 200:
+            await self.shared_cache.put_many({url: body})
 
     async def make_parallel_media_request(self, medias: list, path):
+        """
+        Function to request the path (similar, recommendations) of every media at once.
+        Returns one response per media, in order, None for the media whose request failed.
+        """
         urls = []
         try:
             for media in medias:
                 urls.append(
                     f"{self.api_endpoint}/{self.config.NODE_ENV}/{media[self.config.ID_KEY]}/{path}")
 
-            async with aiohttp.ClientSession() as session:
-                ret = await asyncio.gather(*[self.get(url, session) for url in urls])
+            ret = await self.get_many(urls)
             print("Finalized all. Return is a list of len {} outputs.".format(len(ret)))
 
-            # Convert items from BYTES to JSON
-            completed = []
-            for item in ret:
-                completed.append(json.loads(item))
-
-            return completed, None
+            return self.load_bodies(urls, ret)
 
         except Exception as e:
             print(f"Error {e} attempting to talk to TMDB.")
@@ -114,30 +428,33 @@ class TmdbClient:
             else:
                 params['with_keywords'] = unique_id
 
-            headers = {
-                'Authorization': f"Bearer {self.read_token}"
-            }
             print(f"Discover Params: {params}")
-            result = requests.get(url=f"{self.api_endpoint}/discover/{self.config.NODE_ENV}/",
-                                  headers=headers, params=params)
+            content, status = await self.fetch(
+                f"{self.api_endpoint}/discover/{self.config.NODE_ENV}/?{urlencode(params)}")
         except Exception as error:
             print(f"Error attempting to make request against tmdb: {error}")
             return None, error
 
-        if result.status_code == 200:
+        if status == 200:
             print("Successfully got a response from discover endpoint...")
             try:
-                return result.json(), None
+                return self.parse(content), None
             except json.decoder.JSONDecodeError as err:
                 print("Error with the response returned TMDB. Cleaning up")
                 return None, err
         else:
             print(
-                f"Unexpected response from TMDB. Status: {result.status_code}, content: {result.content}")
+                f"Unexpected response from TMDB. Status: {status}, content: {content}")
             return None, Exception
 
     async def make_parallel_discover_request(self, unique_id_list: str, request_type: str):
+        """
+        Function to request every page of the discover results of every id at once.
+        Returns one response per id with the results of its pages merged in page order and the number of its pages
+        that failed.
+        """
         urls = []
+        pages = max(1, self.config.TMDB_DISCOVER_PAGES.get(request_type, 1))
         try:
             params = {
                 'sort_by': 'vote_average.desc',
@@ -156,38 +473,38 @@ class TmdbClient:
                 else:
                     params['with_keywords'] = unique_id[0]
 
-                param_string = ''
-                for key, value in params.items():
-                    param_string += f"&{key}={value}"
+                for page in range(1, pages + 1):
+                    params['page'] = str(page)
+                    param_string = ''
+                    for key, value in params.items():
+                        param_string += f"&{key}={value}"
 
-                urls.append(
-                    f"{self.api_endpoint}discover/{self.config.NODE_ENV}?{param_string}")
+                    urls.append(
+                        f"{self.api_endpoint}discover/{self.config.NODE_ENV}?{param_string}")
 
-            async with aiohttp.ClientSession() as session:
-                ret = await asyncio.gather(*[self.get(url, session) for url in urls])
+            ret = await self.get_many(urls)
             print(
                 f"Finalized all. Return is a list of len {len(ret)} outputs.")
+            ret, error = self.load_bodies(urls, ret)
+            if error:
+                return None, error
 
-            # Convert items from BYTES to JSON
+            # Convert items from BYTES to JSON, merging the pages of each id and appending the director ID, network
+            # and keywords to the results so they can be used in the calculation algo.
+            tag = request_type if request_type in ('director', 'networks', 'keywords') else None
             completed = []
-            for item in ret:
-                completed.append(json.loads(item))
-
-            # Append the director ID and keywords to the results so they can be used in the calculation algo.
-            if request_type == 'director':
-                for index, discover_result in enumerate(completed):
-                    for media in discover_result['results']:
-                        media['director'] = unique_id_list[index][0]
-
-            if request_type == 'networks':
-                for index, discover_result in enumerate(completed):
-                    for media in discover_result['results']:
-                        media['networks'] = unique_id_list[index][0]
-
-            if request_type == 'keywords':
-                for index, discover_result in enumerate(completed):
-                    for media in discover_result['results']:
-                        media['keywords'] = unique_id_list[index][0]
+            for index, unique_id in enumerate(unique_id_list):
+                results = []
+                failed = 0
+                for item in ret[index * pages:(index + 1) * pages]:
+                    if item is None:
+                        failed += 1
+                        continue
+                    for media in item.get('results', []):
+                        if tag:
+                            media[tag] = unique_id[0]
+                        results.append(media)
+                completed.append({'results': results, 'failed': failed})
 
             return completed, None
 
@@ -204,16 +521,14 @@ class TmdbClient:
             for id in media_ids:
                 urls.append(f"{self.api_endpoint}{self.config.NODE_ENV}/{id}")
 
-            async with aiohttp.ClientSession() as session:
-                ret = await asyncio.gather(*[self.get(url, session) for url in urls])
+            ret = await self.get_many(urls)
             print("Finalized all. Return is a list of len {} outputs.".format(len(ret)))
 
-            # Convert items from BYTES to JSON
-            completed = []
-            for item in ret:
-                completed.append(json.loads(item))
+            completed, error = self.load_bodies(urls, ret)
+            if error:
+                return None, error
 
-            return completed, None
+            return [item for item in completed if item is not None], None
 
         except Exception as e:
             print(f"Error {e} attempting to talk to TMDB.")
@@ -0,0 +1,177 @@
+"""
+Local stand-in for the TMDB endpoints used by TmdbClient
+
+Serves the discover, /{type}/{id}, /{type}/{id}/similar and /{type}/{id}/recommendations endpoints so the fan out,
+caching and rate limiting can be load tested and benchmarked without the real API. Point the clients at it with
+TMDB_API_URL:
+
+    python -m benchmarks.fake_tmdb --port 8900 --latency lognormal:-3,0.6 --error-rate 0.01 --throttle-rate 0.02
+    TMDB_API_URL=http://localhost:8900/3/ python async_rmq.py
+
+Responses are synthetic by default, every media is generated from its id (see benchmarks.synthetic_data) and every
+result page from its url, so the same url always returns the same results. Responses can also be recorded from
+the real API and replayed:
+
+    python -m benchmarks.fake_tmdb --record fixtures/ --upstream https://api.themoviedb.org/3/
+    python -m benchmarks.fake_tmdb --replay fixtures/
+
+Latency distributions are written as fixed:SECONDS, uniform:LOW,HIGH, exponential:MEAN or lognormal:MU,SIGMA.
+"""
+
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import random
+from urllib.parse import urlsplit
+import aiohttp
+from aiohttp import web
+from base.response_cache import normalize_url
+from benchmarks.synthetic_data import make_media
+
+PAGE_SIZE = 20
+TOTAL_PAGES = 500
+
+
+def make_latency(spec: str):
+    """
+    Function to build a function returning the seconds to wait before answering a request
+    """
+    if not spec:
+        return lambda: 0
+    name, _, args = spec.partition(':')
+    values = [float(value) for value in args.split(',') if value]
+    if name == 'fixed':
+        return lambda: values[0]
+    if name == 'uniform':
+        return lambda: random.uniform(values[0], values[1])
+    if name == 'exponential':
+        return lambda: random.expovariate(1 / values[0])
+    if name == 'lognormal':
+        return lambda: random.lognormvariate(values[0], values[1])
+    raise ValueError(f"Unknown latency distribution: {spec}")
+
+
+def fixture_name(url: str) -> str:
+    # Only the path and query are used so fixtures replay from any address
+    parts = urlsplit(normalize_url(url))
+    return hashlib.sha1(f"{parts.path}?{parts.query}".encode()).hexdigest() + '.json'
+
+
+class FakeTmdb:
+
+    def __init__(self, latency: str = None, error_rate: float = 0, throttle_rate: float = 0, retry_after: float = 1,
+                 universe: int = 20000, replay: str = None, record: str = None, upstream: str = None,
+                 seed: int = None) -> None:
+        self.latency = make_latency(latency)
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.universe = universe
+        self.replay = replay
+        self.record = record
+        self.upstream = upstream
+        self.random = random.Random(seed)
+        self.requests = 0
+        self.session = None
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_get('/{path:.*}', self.handle)
+        app.on_cleanup.append(self.close)
+        return app
+
+    async def close(self, app):
+        if self.session is not None:
+            await self.session.close()
+
+    async def handle(self, request: web.Request) -> web.Response:
+        self.requests += 1
+        await asyncio.sleep(self.latency())
+
+        roll = self.random.random()
+        if roll < self.throttle_rate:
+            return web.json_response({'status_code': 25, 'status_message': 'Request count over limit'}, status=429,
+                                     headers={'Retry-After': str(self.retry_after)})
+        if roll < self.throttle_rate + self.error_rate:
+            return web.json_response({'status_code': 11, 'status_message': 'Internal error'}, status=500)
+
+        if self.record:
+            return await self.proxy(request)
+        if self.replay:
+            return self.replayed(request)
+        return self.synthetic(request)
+
+    def replayed(self, request: web.Request) -> web.Response:
+        path = os.path.join(self.replay, fixture_name(str(request.rel_url)))
+        if not os.path.exists(path):
+            return web.json_response({'status_code': 34, 'status_message': 'No recorded response'}, status=404)
+        with open(path) as fixture:
+            recorded = json.load(fixture)
+        return web.Response(text=recorded['body'], status=recorded['status'], content_type='application/json')
+
+    async def proxy(self, request: web.Request) -> web.Response:
+        if self.session is None:
+            self.session = aiohttp.ClientSession()
+        segments = [segment for segment in request.path.split('/') if segment][1:]
+        url = self.upstream.rstrip('/') + '/' + '/'.join(segments)
+        headers = {'Authorization': request.headers.get('Authorization', '')}
+        async with self.session.get(url, params=request.query, headers=headers) as response:
+            body = await response.text()
+            status = response.status
+
+        os.makedirs(self.record, exist_ok=True)
+        with open(os.path.join(self.record, fixture_name(str(request.rel_url))), 'w') as fixture:
+            json.dump({'url': str(request.rel_url), 'status': status, 'body': body}, fixture)
+        return web.Response(text=body, status=status, content_type='application/json')
+
+    def synthetic(self, request: web.Request) -> web.Response:
+        # TmdbClient builds some urls with a double slash, e.g. /3//movie/1/similar
+        segments = [segment for segment in request.path.split('/') if segment][1:]
+        if segments == ['account']:
+            return web.json_response({'id': 1, 'username': 'fake'})
+        if len(segments) == 2 and segments[0] == 'discover':
+            query = urlsplit(normalize_url(str(request.rel_url))).query
+            return web.json_response(self.page('/'.join(segments) + '?' + query, int(request.query.get('page', 1))))
+        if len(segments) == 3 and segments[2] in ('similar', 'recommendations'):
+            return web.json_response(self.page('/'.join(segments), int(request.query.get('page', 1))))
+        if len(segments) == 2 and segments[1].isdigit():
+            return web.json_response(make_media(int(segments[1])))
+        return web.json_response({'status_code': 34, 'status_message': 'Not found'}, status=404)
+
+    def page(self, key: str, page: int) -> dict:
+        seed = int(hashlib.sha1(f"{key}:{page}".encode()).hexdigest()[:12], 16)
+        rng = random.Random(seed)
+        return {'page': page,
+                'results': [make_media(rng.randint(1, self.universe)) for _ in range(PAGE_SIZE)],
+                'total_pages': TOTAL_PAGES,
+                'total_results': TOTAL_PAGES * PAGE_SIZE}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Local stand-in for the TMDB API')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8900)
+    parser.add_argument('--latency', help='Latency distribution, e.g. lognormal:-3,0.6')
+    parser.add_argument('--error-rate', type=float, default=0, help='Share of requests answered with a 500')
+    parser.add_argument('--throttle-rate', type=float, default=0, help='Share of requests answered with a 429')
+    parser.add_argument('--retry-after', type=float, default=1, help='Retry-After seconds of the 429 responses')
+    parser.add_argument('--universe', type=int, default=20000, help='Number of distinct synthetic media')
+    parser.add_argument('--replay', help='Directory of recorded responses to serve')
+    parser.add_argument('--record', help='Directory to record the responses of --upstream into')
+    parser.add_argument('--upstream', default='https://api.themoviedb.org/3/', help='API recorded with --record')
+    parser.add_argument('--seed', type=int, help='Seed of the latency and error injection')
+    args = parser.parse_args()
+
+    fake = FakeTmdb(latency=args.latency, error_rate=args.error_rate, throttle_rate=args.throttle_rate,
+                    retry_after=args.retry_after, universe=args.universe, replay=args.replay, record=args.record,
+                    upstream=args.upstream, seed=args.seed)
+    if args.seed is not None:
+        random.seed(args.seed)
+    print(f"Serving a fake TMDB API on http://{args.host}:{args.port}/3/")
+    web.run_app(fake.app(), host=args.host, port=args.port, print=None)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,221 @@
+"""
+Benchmark for the ReccCalculator on synthetic workloads
+
+Runs do_calculate and every stage of ReccCalculator.pipeline() for users with 10, 100, 1,000 and 5,000 ratings and
+candidate pools with low, medium and high overlap, and reports the wall time and the peak traced memory per stage
+as JSON so runs can be compared between commits:
+
+    python -m benchmarks.recc_benchmark --output bench_output.txt
+    python -m benchmarks.recc_benchmark --compare bench_output.txt
+
+With --batch-users it instead compares ReccCalculator.do_calculate_many against calling do_calculate user by user, for
+users that share the same universe of media and for users with disjoint candidate pools:
+
+    python -m benchmarks.recc_benchmark --batch-users 50 200 400 --ratings 100 --overlap 0.5
+
+Wall time is the best of --repeat runs without tracing, peak memory is taken from a separate tracemalloc run.
+"""
+
+import argparse
+import datetime
+import json
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+import numpy as np
+from base.recc_calculator import CalculationContext, ReccCalculator
+from benchmarks.synthetic_data import make_tmdb_data
+from env_config import Config
+
+RATINGS = [10, 100, 1000, 5000]
+OVERLAPS = [0.2, 0.5, 0.8]
+MODES = ['indexed', 'vectorized']
+BATCH_USERS = [50, 200, 400]
+
+
+def run_stages(calculator: ReccCalculator, tmdb_data: dict, measure) -> list:
+    """
+    Function to run the scoring pipeline one stage at a time, handing every stage to `measure`
+    """
+    context = CalculationContext(tmdb_data)
+    for name, stage in calculator.pipeline():
+        measure(name, lambda: stage(context))
+
+    return context.results
+
+
+def time_stages(calculator: ReccCalculator, tmdb_data: dict) -> dict:
+    timings = {}
+
+    def measure(stage, func):
+        start = time.perf_counter()
+        result = func()
+        timings[stage] = time.perf_counter() - start
+        return result
+
+    run_stages(calculator, tmdb_data, measure)
+    start = time.perf_counter()
+    calculator.do_calculate(tmdb_data)
+    timings['do_calculate'] = time.perf_counter() - start
+    return timings
+
+
+def trace_stages(calculator: ReccCalculator, tmdb_data: dict) -> dict:
+    peaks = {}
+
+    def measure(stage, func):
+        tracemalloc.reset_peak()
+        start, _ = tracemalloc.get_traced_memory()
+        result = func()
+        _, peak = tracemalloc.get_traced_memory()
+        peaks[stage] = peak - start
+        return result
+
+    tracemalloc.start()
+    try:
+        run_stages(calculator, tmdb_data, measure)
+        measure('do_calculate', lambda: calculator.do_calculate(tmdb_data))
+    finally:
+        tracemalloc.stop()
+    return peaks
+
+
+def run_scenario(num_ratings: int, overlap: float, mode: str, repeat: int, pages: int) -> dict:
+    config = Config()
+    calculator = ReccCalculator()
+    calculator.config.RECC_SCORING_MODE = mode
+    tmdb_data = make_tmdb_data(num_ratings=num_ratings, overlap=overlap, id_key=config.ID_KEY,
+                               tv=config.NODE_ENV == 'tv', pages=pages)
+    candidates = len(calculator.merge_sources(tmdb_data))
+
+    best = {}
+    for _ in range(repeat):
+        for stage, seconds in time_stages(calculator, tmdb_data).items():
+            best[stage] = min(seconds, best.get(stage, seconds))
+    peaks = trace_stages(calculator, tmdb_data)
+
+    return {'scenario': f"ratings={num_ratings},overlap={overlap},pages={pages},mode={mode}",
+            'ratings': num_ratings, 'overlap': overlap, 'pages': pages, 'mode': mode,
+            'candidates': candidates,
+            'unique_candidates': len(calculator.prepare_candidates(tmdb_data)),
+            'stages': {stage: {'seconds': round(best[stage], 6), 'peak_bytes': peaks[stage]} for stage in best}}
+
+
+def make_batch(users: int, num_ratings: int, overlap: float, pages: int, shared: bool) -> list:
+    """
+    Function to generate the tmdb_data of many users, with the results trimmed to TMDB_RESULT_FIELDS like parsed
+    TMDB responses
+    """
+    config = Config()
+    fields = config.TMDB_RESULT_FIELDS + ['director', 'keywords', 'networks']
+    batch = []
+    for seed in range(users):
+        tmdb_data = make_tmdb_data(num_ratings=num_ratings, overlap=overlap, id_key=config.ID_KEY,
+                                   tv=config.NODE_ENV == 'tv', seed=seed, pages=pages,
+                                   first_id=1 if shared else 1 + seed * 10 ** 7)
+        for source in ('discover_genres', 'discover_keywords', 'discover_directors', 'discover_networks',
+                       'similar_movies', 'recommeded_movies'):
+            tmdb_data[source] = [{field: media[field] for field in fields if field in media}
+                                 for media in tmdb_data[source]]
+        batch.append(tmdb_data)
+    return batch
+
+
+def run_batch_scenario(users: int, num_ratings: int, overlap: float, modes: list, repeat: int, pages: int,
+                       shared: bool) -> dict:
+    batch = make_batch(users, num_ratings, overlap, pages, shared)
+    calculator = ReccCalculator(metrics_sinks=[])
+
+    def best(func) -> float:
+        seconds = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            func(batch)
+            seconds.append(time.perf_counter() - start)
+        return round(min(seconds), 6)
+
+    timings = {'do_calculate_many': best(calculator.do_calculate_many)}
+    for mode in modes:
+        calculator.config.RECC_SCORING_MODE = mode
+        timings[f"do_calculate_{mode}"] = best(lambda inputs: [calculator.do_calculate(tmdb_data)
+                                                               for tmdb_data in inputs])
+
+    pools = 'shared' if shared else 'disjoint'
+    print(f"users={users:<5} {pools:<9} " + ' '.join(f"{name}={seconds:.3f}s" for name, seconds in timings.items()),
+          file=sys.stderr)
+    return {'scenario': f"users={users},ratings={num_ratings},overlap={overlap},pages={pages},pools={pools}",
+            'users': users, 'ratings': num_ratings, 'overlap': overlap, 'pages': pages, 'pools': pools,
+            'seconds': timings}
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except Exception:
+        return 'unknown'
+
+
+def compare(report: dict, baseline_path: str):
+    """
+    Function to print the change of every stage against a previous report. Batch scenarios are not compared.
+    """
+    with open(baseline_path) as baseline_file:
+        baseline = json.load(baseline_file)
+    previous = {result['scenario']: result['stages'] for result in baseline['results'] if 'stages' in result}
+    print(f"Comparing {report['meta']['commit']} against {baseline['meta']['commit']}", file=sys.stderr)
+    for result in report['results']:
+        for stage, values in result.get('stages', {}).items():
+            before = previous.get(result['scenario'], {}).get(stage)
+            if not before or not before['seconds']:
+                continue
+            print(f"{result['scenario']:<50} {stage:<16} {before['seconds']:>10.6f}s -> {values['seconds']:>10.6f}s "
+                  f"({values['seconds'] / before['seconds']:.2f}x) "
+                  f"{before['peak_bytes']:>10} -> {values['peak_bytes']:>10} bytes", file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the recommendation calculator on synthetic workloads')
+    parser.add_argument('--ratings', type=int, nargs='+', default=RATINGS)
+    parser.add_argument('--overlap', type=float, nargs='+', default=OVERLAPS)
+    parser.add_argument('--modes', nargs='+', default=MODES, choices=MODES)
+    parser.add_argument('--pages', type=int, default=1, help='Pages of discover/similar/recommended results per id')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--output', help='Write the JSON report to this file instead of stdout')
+    parser.add_argument('--compare', help='Previous JSON report to compare against')
+    parser.add_argument('--batch-users', type=int, nargs='*',
+                        help=f"Compare do_calculate_many with a do_calculate loop for these numbers of users, "
+                             f"e.g. {' '.join(map(str, BATCH_USERS))}")
+    args = parser.parse_args()
+
+    results = []
+    for num_ratings in args.ratings:
+        for overlap in args.overlap:
+            if args.batch_users:
+                for users in args.batch_users:
+                    for shared in (False, True):
+                        results.append(run_batch_scenario(users, num_ratings, overlap, args.modes, args.repeat,
+                                                          args.pages, shared))
+                continue
+            for mode in args.modes:
+                results.append(run_scenario(num_ratings, overlap, mode, args.repeat, args.pages))
+
+    report = {'meta': {'commit': git_commit(), 'timestamp': datetime.datetime.now().isoformat(),
+                       'python': platform.python_version(), 'numpy': np.__version__,
+                       'node_env': Config().NODE_ENV},
+              'results': results}
+
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(report, output_file, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+    if args.compare:
+        compare(report, args.compare)
+
+
+if __name__ == '__main__':
+    main()
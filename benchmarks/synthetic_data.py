@@ -0,0 +1,95 @@
+"""
+Synthetic recommendation workloads shaped like the output of RecommendationsHelper.gather_reccs_data
+
+    rated_movies        -> one document per rating with director, genres, keywords (and networks for tv)
+    directors/genres/.. -> the 6 most common details of the rated media, as (id, count) pairs
+    discover_*          -> `pages` pages of 20 media per most common detail, tagged like TmdbClient tags them
+    similar/recommended -> `pages` pages of 20 media per top rated media (at most 19)
+
+Media ids are drawn from a universe whose size is set by `overlap`: 0 means almost every discovered media is
+unique, values close to 1 mean the same media come back from many sources. Every media is generated from its id
+so repeated occurrences carry the same genres and vote_average, as they do in TMDB. Users generated with the same
+`first_id` share the universe, users far enough apart have disjoint pools.
+"""
+
+import random
+from base.recommendations_helper import RecommendationsHelper
+
+GENRE_IDS = [28, 12, 16, 35, 80, 99, 18, 10751, 14, 36, 27, 10402, 9648, 10749, 878, 10770, 53, 10752, 37]
+
+
+def make_media(media_id: int) -> dict:
+    rng = random.Random(media_id)
+    return {'adult': False,
+            'backdrop_path': f"/{media_id}-backdrop.jpg",
+            'genre_ids': rng.sample(GENRE_IDS, rng.randint(1, 4)),
+            'id': media_id,
+            'original_language': 'en',
+            'original_title': f"Media {media_id}",
+            'overview': ' '.join(rng.choice(['a', 'story', 'about', 'the', 'hero', 'who']) for _ in range(60)),
+            'popularity': round(rng.uniform(1, 200), 3),
+            'poster_path': f"/{media_id}-poster.jpg",
+            'release_date': f"{rng.randint(1950, 2024)}-01-01",
+            'title': f"Media {media_id}",
+            'video': False,
+            'vote_average': round(rng.uniform(5, 9), 3),
+            'vote_count': rng.randint(1000, 30000)}
+
+
+def skewed_id(rng: random.Random, limit: int) -> int:
+    # Users rate a few directors/keywords a lot and most of them once
+    return min(int(rng.paretovariate(1.1)), limit)
+
+
+def make_rated_media(rng: random.Random, media_id: int, id_key: str, tv: bool) -> dict:
+    media = {id_key: media_id,
+             'user_id': 'benchmark',
+             'rating': rng.randint(1, 10),
+             'director': skewed_id(rng, 400),
+             'genres': [{'id': genre} for genre in sorted(rng.sample(GENRE_IDS[:6], rng.randint(1, 2)))],
+             'keywords': [{'id': skewed_id(rng, 2000)} for _ in range(rng.randint(0, 8))]}
+    if tv:
+        media['networks'] = {'id': skewed_id(rng, 50)}
+    return media
+
+
+def make_tmdb_data(num_ratings: int, overlap: float, id_key: str = 'movie_id', tv: bool = False, seed: int = 0,
+                   pages: int = 1, page_size: int = 20, first_id: int = 1) -> dict:
+    rng = random.Random(seed)
+    num_candidates = (6 * 3 + 19 * 2) * pages * page_size
+    universe = max(page_size, int(num_candidates * (1 - overlap)))
+    last_id = first_id + universe - 1
+
+    def page() -> list:
+        return [make_media(rng.randint(first_id, last_id)) for _ in range(page_size * pages)]
+
+    # Some ratings are for media that can also be discovered so removing rated media has work to do
+    rated_ids = set(rng.sample(range(first_id, last_id + 1), min(universe // 5, num_ratings // 2)))
+    while len(rated_ids) < num_ratings:
+        rated_ids.add(rng.randint(last_id + 1, last_id + num_ratings * 10))
+    rated_media = [make_rated_media(rng, media_id, id_key, tv) for media_id in rated_ids]
+
+    directors, genres, keywords, networks = RecommendationsHelper.extract_details_for_discover(rated_media)
+    top_media = sorted((media for media in rated_media if media['rating'] > 6),
+                       key=lambda media: media['rating'], reverse=True)[0:19]
+
+    def discover(details: list, tag: str = None) -> list:
+        results = []
+        for detail in details:
+            for media in page():
+                if tag:
+                    media[tag] = detail[0]
+                results.append(media)
+        return results
+
+    return {'discover_directors': [] if tv else discover(directors, 'director'),
+            'discover_genres': discover(genres),
+            'discover_keywords': discover(keywords, 'keywords'),
+            'discover_networks': discover(networks, 'networks') if tv else [],
+            'similar_movies': [media for _ in top_media for media in page()],
+            'recommeded_movies': [media for _ in top_media for media in page()],
+            'rated_movies': rated_media,
+            'directors': [list(item) for item in directors],
+            'keywords': [list(item) for item in keywords],
+            'networks': [list(item) for item in networks],
+            'genres': [list(item) for item in genres]}
@@ -25,8 +25,77 @@ class Config:
 
         self.TMDB_API = os.getenv('TMDB_API')
         self.TMDB_READ_TOKEN = os.getenv('TMDB_READ_TOKEN')
+        # Fields kept from every TMDB result: the ones scoring needs and the ones shown in the UI. Empty keeps them all
+        result_fields = os.getenv('TMDB_RESULT_FIELDS', 'id,genre_ids,vote_average,vote_count,popularity,title,name,'
+                                                        'original_language,poster_path,release_date,first_air_date')
+        self.TMDB_RESULT_FIELDS = [field.strip() for field in result_fields.split(',') if field.strip()]
+        # Base url of the TMDB API, e.g. the stand-in of benchmarks.fake_tmdb
+        self.TMDB_API_URL = os.getenv('TMDB_API_URL', 'https://api.themoviedb.org/3/')
+        # Maximum number of TMDB requests in flight per event loop. Halved on every 429 or 5xx and grown back on success
+        self.TMDB_MAX_CONCURRENCY = int(os.getenv('TMDB_MAX_CONCURRENCY', '20'))
+        # TMDB requests a second across the process and the burst allowed above it, 0 does not limit the rate
+        self.TMDB_RATE_LIMIT = float(os.getenv('TMDB_RATE_LIMIT', '40'))
+        self.TMDB_RATE_BURST = int(os.getenv('TMDB_RATE_BURST', '40'))
+        # Seconds a single TMDB request may take and a whole fan out of requests may take, 0 does not time out
+        self.TMDB_REQUEST_TIMEOUT_SECONDS = float(os.getenv('TMDB_REQUEST_TIMEOUT_SECONDS', '10'))
+        self.TMDB_FANOUT_DEADLINE_SECONDS = float(os.getenv('TMDB_FANOUT_DEADLINE_SECONDS', '30'))
+        # Latency percentile of the recent requests after which a duplicate request is sent, e.g. 95. 0 disables it
+        self.TMDB_HEDGE_PERCENTILE = float(os.getenv('TMDB_HEDGE_PERCENTILE', '0'))
+        # Retries of a TMDB request on a 429, 5xx or connection error, with a jittered exponential backoff
+        self.TMDB_MAX_RETRIES = int(os.getenv('TMDB_MAX_RETRIES', '3'))
+        self.TMDB_RETRY_BASE_SECONDS = float(os.getenv('TMDB_RETRY_BASE_SECONDS', '0.5'))
+        self.TMDB_RETRY_MAX_SECONDS = float(os.getenv('TMDB_RETRY_MAX_SECONDS', '10'))
+        # Connection pool of the TMDB session shared by every client on an event loop
+        self.TMDB_CONNECTION_LIMIT = int(os.getenv('TMDB_CONNECTION_LIMIT', '50'))
+        self.TMDB_KEEPALIVE_SECONDS = float(os.getenv('TMDB_KEEPALIVE_SECONDS', '30'))
+        self.TMDB_DNS_CACHE_SECONDS = int(os.getenv('TMDB_DNS_CACHE_SECONDS', '300'))
+        # In-process TMDB response cache, bounded by entries and bytes. 0 disables it
+        self.TMDB_CACHE_MAX_ENTRIES = int(os.getenv('TMDB_CACHE_MAX_ENTRIES', '5000'))
+        self.TMDB_CACHE_MAX_BYTES = int(os.getenv('TMDB_CACHE_MAX_BYTES', str(64 * 1024 * 1024)))
+        # Seconds a response is cached for per endpoint, 0 does not cache the endpoint
+        self.TMDB_CACHE_TTLS = os.getenv('TMDB_CACHE_TTLS',
+                                         'discover=21600,similar=86400,recommendations=86400,media=3600')
+        # Mongo cache tier shared by every process, checked after the in-process cache. Expired responses are still
+        # served for TMDB_SHARED_CACHE_STALE_SECONDS while they are refreshed in the background
+        self.TMDB_SHARED_CACHE = os.getenv('TMDB_SHARED_CACHE', 'true').lower() == 'true'
+        self.TMDB_SHARED_CACHE_STALE_SECONDS = float(os.getenv('TMDB_SHARED_CACHE_STALE_SECONDS', '86400'))
+        # Seconds close_session waits for the background refreshes and shared cache writes of a short lived event
+        # loop (every async Flask view) before cancelling them. 0 waits for them to finish
+        self.TMDB_BACKGROUND_DRAIN_SECONDS = float(os.getenv('TMDB_BACKGROUND_DRAIN_SECONDS', '5'))
+        # Pages of discover results (20 a page) requested per id. TMDB_DISCOVER_PAGES_<TYPE> overrides the default
+        # for a discover type, e.g. TMDB_DISCOVER_PAGES_GENRE=3
+        discover_pages = os.getenv('TMDB_DISCOVER_PAGES', '1')
+        self.TMDB_DISCOVER_PAGES = {request_type: int(os.getenv(f'TMDB_DISCOVER_PAGES_{request_type.upper()}',
+                                                                discover_pages))
+                                    for request_type in ('director', 'genre', 'keywords', 'networks')}
         self.VALID_CORS = os.getenv('VALID_CORS')
 
+        # 'indexed' scores media one at a time, 'vectorized' scores every media with numpy array operations
+        self.RECC_SCORING_MODE = os.getenv('RECC_SCORING_MODE', 'indexed')
+        # Fold the TMDB responses into the recommendation weights as they arrive instead of scoring them in the
+        # calculation pool once every response is in. Streamed recommendations are not updated incrementally
+        self.RECC_STREAMING = os.getenv('RECC_STREAMING', 'false').lower() == 'true'
+        # Score the sources that were fetched when others fail instead of failing the recommendations
+        self.RECC_PARTIAL_RESULTS = os.getenv('RECC_PARTIAL_RESULTS', 'true').lower() == 'true'
+        # 'profile' counts the details from the stored taste profile, 'aggregation' has Mongo count them
+        self.RECC_DETAILS_SOURCE = os.getenv('RECC_DETAILS_SOURCE', 'profile')
+        # Number of recommendations kept per user, 0 keeps every candidate
+        self.RECC_TOP_K = int(os.getenv('RECC_TOP_K', '0'))
+        # Fields of a discovered media stored with the recommendations and shown in the UI
+        display_fields = os.getenv('RECC_DISPLAY_FIELDS', 'id,title,name,original_language,poster_path,release_date,'
+                                                          'first_air_date,vote_average,vote_count,popularity')
+        self.RECC_DISPLAY_FIELDS = tuple(field.strip() for field in display_fields.split(',') if field.strip())
+        # Number of incremental updates applied to a users recommendations before forcing a full recompute
+        self.RECC_MAX_INCREMENTAL_UPDATES = int(os.getenv('RECC_MAX_INCREMENTAL_UPDATES', '10'))
+        # Comma separated sinks the scoring stage timings are reported to, e.g. 'prometheus'
+        self.RECC_METRICS_SINKS = os.getenv('RECC_METRICS_SINKS', '')
+        # Port the consumer serves prometheus metrics on, disabled when not set
+        self.METRICS_PORT = os.getenv('METRICS_PORT')
+        # Processes used to score recommendations off the event loop. Defaults to the CPUs of the container,
+        # 0 scores on the event loop
+        workers = os.getenv('RECC_CALC_WORKERS')
+        self.RECC_CALC_WORKERS = int(workers) if workers else None
+
         if self.NODE_ENV == 'tv':
             self.load_tv_configs()
         else:
@@ -36,6 +105,8 @@ class Config:
         self.ROUTING_KEY = 'television_recommendations'
         self.RECOMMENDATIONS_COLLECTION = 'recommended_televisions'
         self.RATED_COLLECTION = 'television_rateds'
+        self.RECOMMENDATIONS_STATE_COLLECTION = 'recommended_television_states'
+        self.TASTE_PROFILE_COLLECTION = 'television_taste_profiles'
         self.ID_KEY = 'tv_id'
         self.INFO_KEY = 'tv_info'
 
@@ -43,5 +114,7 @@ class Config:
         self.ROUTING_KEY = 'movie_recommendations'
         self.RECOMMENDATIONS_COLLECTION = 'recommended_movies'
         self.RATED_COLLECTION = 'rated_movies'
+        self.RECOMMENDATIONS_STATE_COLLECTION = 'recommended_movie_states'
+        self.TASTE_PROFILE_COLLECTION = 'movie_taste_profiles'
         self.ID_KEY = 'movie_id'
         self.INFO_KEY = 'movie_info'
@@ -3,7 +3,7 @@ import flask
 from flask import Flask, jsonify, request, Response
 from flask_cors import CORS
 from prometheus_flask_exporter import PrometheusMetrics
-from base.tmdbclient import TmdbClient
+from base.tmdbclient import TmdbClient, close_session
 from base.mongoclient import MongoClient
 from base.status import StatusClient
 from base.rabbitmq_client import RabbitMqClient
@@ -50,7 +50,11 @@ async def mongo_test():
 # we define the route /
 @app.route('/tmdb_ping')
 async def tmdb_test():
-    ping_response, ping_status = await TmdbClient().ping()
+    try:
+        ping_response, ping_status = await TmdbClient().ping()
+    finally:
+        # Every async view runs on its own event loop, so its TMDB session is closed with it
+        await close_session()
     # return a json
     return Response(ping_response, status=ping_status)
 
@@ -88,7 +92,10 @@ async def get_watchlist():
     if user_id:
         print(f"Request received to get watchlist for user {user_id}...")
         movie_list = request.json.get('movie_list')
-        result, error = await Watchlist().process_watchlist(media_list=movie_list)
+        try:
+            result, error = await Watchlist().process_watchlist(media_list=movie_list)
+        finally:
+            await close_session()
         # return a json
         if error:
             return {'status': str(error)}
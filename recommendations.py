@@ -3,10 +3,12 @@ from env_config import Config
 from base.mongoclient import MongoClient
 from base.tmdbclient import TmdbClient
 from base.rabbitmq_client import RabbitMqClient
-import json
 import datetime
-from base.recommendations_helper import RecommendationException, JSONEncoder, RecommendationsHelper
+from base.recommendations_helper import RecommendationException, RecommendationsHelper
 from base.recc_calculator import ReccCalculator
+from base.calc_executor import CalculationExecutor
+from base.streaming_calculator import StreamingReccCalculator
+from base.recc_data import ReccInput
 
 
 class Recommendations:
@@ -14,10 +16,12 @@ class Recommendations:
     def __init__(self) -> None:
         self.config = Config()
         self.mongo_client = MongoClient()
-        self.tmdb_client = TmdbClient()
+        self.tmdb_client = TmdbClient(mongo_client=self.mongo_client)
         self.rabbitmq_client = RabbitMqClient()
         self.recc_helper = RecommendationsHelper()
         self.recc_calculator = ReccCalculator()
+        self.calc_executor = CalculationExecutor(workers=self.config.RECC_CALC_WORKERS)
+        self.stream_calculator = StreamingReccCalculator()
         self.rec_collection = self.mongo_client.recommended_collection()
 
     async def process_recommendations(self, user_id: str):
@@ -25,7 +29,8 @@ class Recommendations:
         Logic to identify we need to process a new recommendations request
         """
         # Check for existing recommendations
-        stored_reccs, error = await self.recc_helper.query_mongo_for_user(user_id, self.config.RECOMMENDATIONS_COLLECTION)
+        stored_reccs, error = await self.recc_helper.query_mongo_for_user(
+            user_id, self.config.RECOMMENDATIONS_COLLECTION, query=self.recc_helper.media_query_build(user_id, limit=1))
         if error:
             print(f"Error {error} attempting to get recommended media")
             return None, RecommendationException
@@ -38,19 +43,15 @@ class Recommendations:
                 return None, error
 
             if need_new_reccs:
-                # Apply logic to generate new recommendations
-                recommendations, err = await self.generate_new_recommendations(user_id=user_id, is_new=False, existing_reccs=stored_reccs[0]['_id'])
+                # Apply the newly rated media to the recommendations, or generate new ones when that is not possible
+                recommendations, err = await self.update_recommendations(user_id=user_id, stored_reccs=stored_reccs[0])
 
             if ongoing_update:
                 # Return recommendations that were generated while this request was made
-                encoded_reccs = JSONEncoder().encode(need_new_reccs)
-                encoded_reccs = json.loads(encoded_reccs)
-                return encoded_reccs, None
+                return need_new_reccs, None
             else:
                 # Return existing recommendations
-                encoded_reccs = JSONEncoder().encode(stored_reccs[0])
-                encoded_reccs = json.loads(encoded_reccs)
-                return encoded_reccs, None
+                return stored_reccs[0], None
         else:
             # Apply logic to generate new recommendations
             print('No existing recommendations found. Generating new ones')
@@ -67,7 +68,11 @@ class Recommendations:
             updated_doc = await self.recc_helper.set_in_progress(user_id=user_id, is_new=is_new, existing_reccs=existing_reccs)
 
             print('Attempting to gather rated data from the database')
-            recc_data, error = await self.recc_helper.gather_reccs_data(user_id=user_id)
+            if self.config.RECC_STREAMING:
+                # The discovered media are streamed into the calculator below
+                recc_data, error = await self.recc_helper.gather_reccs_details(user_id=user_id)
+            else:
+                recc_data, error = await self.recc_helper.gather_reccs_data(user_id=user_id)
             if error:
                 print(f"Error {error} attempting to gather rated data. Setting state in DB to failed for {updated_doc.inserted_id}.")
                 await self.rec_collection.update_one({'_id': updated_doc.inserted_id},
@@ -75,9 +80,17 @@ class Recommendations:
                                                   '$currentDate': {'updatedAt': True}})
                 return None, Exception
 
+            # Stored before the calculation, which releases the discovered media once they are merged
+            await self.store_calc_state(user_id=user_id, tmdb_data=recc_data)
             print("Attempting to process recommendation data...")
-            sorted_reccomendations = self.recc_calculator.do_calculate(
-                tmdb_data=json.loads(recc_data))
+            if self.config.RECC_STREAMING:
+                sorted_reccomendations, stage_timings = await self.stream_calculator.calculate_stream(
+                    tmdb_data=recc_data, batches=self.recc_helper.stream_reccs_data(recc_data))
+            else:
+                sorted_reccomendations, stage_timings = await self.calc_executor.calculate(self.recc_calculator,
+                                                                                          tmdb_data=recc_data,
+                                                                                          release_input=True)
+            print(f"Calculation stage timings: {stage_timings}")
 
             print("Updating recommendations in Mongo...")
             if not existing_reccs:
@@ -89,7 +102,8 @@ class Recommendations:
             print(existing_reccs)
 
             result = await self.rec_collection.update_one({'_id': existing_reccs}, {
-                '$set': {'recommendations': sorted_reccomendations, 'state': 'complete'},
+                '$set': {'recommendations': sorted_reccomendations, 'state': 'complete',
+                         'stage_timings': stage_timings, 'missing_sources': recc_data.get('missing_sources', [])},
                 '$currentDate': {'updatedAt': True}})
             print(result)
             return sorted_reccomendations, None
@@ -102,6 +116,65 @@ class Recommendations:
                                                   '$currentDate': {'updatedAt': True}})
             return None, Exception(str(err))
 
+    async def update_recommendations(self, user_id: str, stored_reccs: dict):
+        """
+        Handle the logic to update existing recommendations. Only the media rated since the recommendations were last
+        updated are applied when we have the users calculation state, otherwise new recommendations are generated.
+        """
+        recommendations, err = await self.generate_incremental_recommendations(user_id=user_id,
+                                                                               stored_reccs=stored_reccs)
+        if recommendations is not None:
+            return recommendations, None
+
+        if err:
+            print(f"Error {err} attempting to update recommendations incrementally")
+        print("Unable to update recommendations incrementally. Generating new recommendations")
+        return await self.generate_new_recommendations(user_id=user_id, is_new=False, existing_reccs=stored_reccs['_id'])
+
+    async def generate_incremental_recommendations(self, user_id: str, stored_reccs: dict):
+        """
+        Handle the logic to apply newly rated media to the stored calculation state and rescore it.
+        Returns None when the recommendations can not be updated incrementally.
+        """
+        existing_reccs = stored_reccs['_id']
+        try:
+            recc_data, error = await self.recc_helper.gather_incremental_reccs_data(user_id=user_id)
+            if error or recc_data is None:
+                return None, error
+
+            await self.recc_helper.set_in_progress(user_id=user_id, is_new=False, existing_reccs=existing_reccs)
+            await self.store_calc_state(user_id=user_id, tmdb_data=recc_data)
+            print("Attempting to incrementally process recommendation data...")
+            sorted_reccomendations, stage_timings = await self.calc_executor.calculate(self.recc_calculator,
+                                                                                      tmdb_data=recc_data,
+                                                                                      release_input=True)
+            print(f"Calculation stage timings: {stage_timings}")
+
+            result = await self.rec_collection.update_one({'_id': existing_reccs}, {
+                '$set': {'recommendations': sorted_reccomendations, 'state': 'complete',
+                         'stage_timings': stage_timings, 'missing_sources': recc_data.get('missing_sources', [])},
+                '$currentDate': {'updatedAt': True}})
+            print(result)
+            return sorted_reccomendations, None
+        except Exception as err:
+            print(
+                f"Error {err} seen when attempting to incrementally calculate reccommendations")
+            print(traceback.format_exc())
+            return None, Exception(str(err))
+
+    async def store_calc_state(self, user_id: str, tmdb_data: ReccInput):
+        """
+        Store the calculation state for the user. A failure here only means the next update is a full recompute.
+        """
+        try:
+            if self.config.RECC_STREAMING or tmdb_data.get('missing_sources'):
+                # The discovered media were not kept or are incomplete, a stale state must not be updated incrementally
+                await self.recc_helper.clear_calc_state(user_id=user_id)
+            else:
+                await self.recc_helper.save_calc_state(user_id=user_id, tmdb_data=tmdb_data)
+        except Exception as err:
+            print(f"Error {err} attempting to store the calculation state for user {user_id}")
+
     async def handle_stored_reccs(self, user_id, stored_reccs):
         """
         Function to handle processing of existing reccs and logic around if we need new ones or if we are currently generating reccs.
@@ -117,10 +190,8 @@ class Recommendations:
                 return inprogress_reccs, True, err
 
             # Check against rated movies to see if we need to update the recommendations
-            encoded_reccs = JSONEncoder().encode(stored_reccs[0])
-            encoded_reccs = json.loads(encoded_reccs)
             print("Comparing recommendations against existing ratings... ")
-            need_new_reccs, error = await self.compare_reccs_with_rated(user_id=user_id, encoded_reccs=encoded_reccs)
+            need_new_reccs, error = await self.compare_reccs_with_rated(user_id=user_id, stored_reccs=stored_reccs[0])
             if error:
                 print(
                     f"Error {error} seen attempting to compare recommendations with rated media")
@@ -133,25 +204,22 @@ class Recommendations:
                 f"Error {e} seen attempting to compare recommendations with rated media")
             return None, False, RecommendationException
 
-    async def compare_reccs_with_rated(self, user_id, encoded_reccs: dict):
+    async def compare_reccs_with_rated(self, user_id, stored_reccs: dict):
         """
         Function to compare the stored reccs with the most recent rated movie to see if the reccs need to be updated
         Will return True if we need to update the reccomendations
         """
         print(
             f"Recommendations stored for user {user_id}, checking to see if they're up to date.")
-        reccs_updated = datetime.datetime.fromisoformat(
-            encoded_reccs['updatedAt'])
+        reccs_updated: datetime.datetime = stored_reccs['updatedAt']
 
         # Getting rated media
-        recent_media, error = await self.recc_helper.most_recent_rated_media(user_id)
+        recent_updated, error = await self.recc_helper.latest_rated_update(user_id)
         if error:
             print(f"Error {error} attempting to get rated media")
             return None, RecommendationException
-        encoded_recent = JSONEncoder().encode(recent_media[0])
-        encoded_recent = json.loads(encoded_recent)
-        recent_updated = datetime.datetime.fromisoformat(
-            encoded_recent['updatedAt'])
+        if recent_updated is None:
+            return False, None
         print(f"RECCS UPDATED: {reccs_updated}")
         print(f"RECENT UPLOADED: {recent_updated}")
         if reccs_updated < recent_updated:
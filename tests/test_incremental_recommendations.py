@@ -0,0 +1,191 @@
+"""
+Equivalence of the incremental recommendation updates with a full recompute
+
+The rated media, taste profiles and calculation states live in in-memory collections and the TMDB requests go to a
+FakeTmdb. After every change to the ratings the recommendations are updated incrementally from the stored state and
+recomputed from scratch, and both have to rank the same media with the same weights.
+
+    python -m unittest discover tests
+"""
+
+import copy
+import datetime
+import random
+import unittest
+from base.recc_calculator import ReccCalculator
+from base.recommendations_helper import RecommendationsHelper
+from base.response_cache import ResponseCache
+from benchmarks.synthetic_data import make_rated_media
+from tests.test_tmdb_client import FakeTmdbTestCase
+
+USER_ID = 'benchmark'
+
+
+def matches(doc: dict, query: dict) -> bool:
+    for key, value in query.items():
+        if isinstance(value, dict) and '$gt' in value:
+            if doc.get(key) is None or not doc[key] > value['$gt']:
+                return False
+        elif doc.get(key) != value:
+            return False
+    return True
+
+
+def project(doc: dict, projection: dict) -> dict:
+    # Only inclusion projections are used, a dotted field keeps its whole top level field
+    fields = {key.split('.')[0] for key, value in projection.items() if value}
+    return {key: value for key, value in doc.items() if key in fields}
+
+
+class FakeCollection:
+    """
+    In-memory stand-in for the motor collection methods and aggregation stages the helper uses
+    """
+
+    def __init__(self, docs: list = None) -> None:
+        self.docs = copy.deepcopy(docs or [])
+
+    async def find_one(self, query: dict):
+        for doc in self.docs:
+            if matches(doc, query):
+                return copy.deepcopy(doc)
+        return None
+
+    async def replace_one(self, query: dict, replacement: dict, upsert: bool = False):
+        await self.delete_one(query)
+        self.docs.append(copy.deepcopy(replacement))
+
+    async def update_one(self, query: dict, update: dict, upsert: bool = False):
+        doc = next((doc for doc in self.docs if matches(doc, query)), None)
+        if doc is None:
+            doc = dict(query)
+            self.docs.append(doc)
+        doc.update(copy.deepcopy(update.get('$set', {})))
+        for key in update.get('$currentDate', {}):
+            doc[key] = datetime.datetime.now()
+
+    async def delete_one(self, query: dict):
+        self.docs = [doc for doc in self.docs if not matches(doc, query)]
+
+    async def count_documents(self, query: dict) -> int:
+        return sum(matches(doc, query) for doc in self.docs)
+
+    def aggregate(self, pipeline: list) -> list:
+        docs = self.docs
+        for stage in pipeline:
+            if '$match' in stage:
+                docs = [doc for doc in docs if matches(doc, stage['$match'])]
+            elif '$sort' in stage:
+                (key, direction), = stage['$sort'].items()
+                docs = sorted(docs, key=lambda doc: doc[key], reverse=direction < 0)
+            elif '$limit' in stage:
+                docs = docs[:stage['$limit']]
+            elif '$project' in stage:
+                docs = [project(doc, stage['$project']) for doc in docs]
+        return copy.deepcopy(docs)
+
+
+class FakeMongoClient:
+
+    def __init__(self, rated_collection: FakeCollection, collections: dict) -> None:
+        self.rated = rated_collection
+        self.collections = collections
+
+    def rated_collection(self) -> FakeCollection:
+        return self.rated
+
+    async def make_request(self, query: list, collection: str, database: str = 'whattowatch'):
+        return self.collections[collection].aggregate(query), None
+
+
+class IncrementalEquivalenceTest(FakeTmdbTestCase):
+
+    async def asyncSetUp(self):
+        self.fake, server = await self.serve()
+        self.helper = RecommendationsHelper()
+        config = self.helper.config
+        self.id_key = config.ID_KEY
+        self.clock = datetime.datetime(2024, 1, 1)
+        rng = random.Random(7)
+        rated = []
+        for media_id in rng.sample(range(1, 5000), 60):
+            media = make_rated_media(rng, media_id, self.id_key, tv=config.NODE_ENV == 'tv')
+            media['user_id'] = USER_ID
+            media['updatedAt'] = self.tick()
+            rated.append(media)
+        self.rated = FakeCollection(rated)
+        self.helper.mongo_client = FakeMongoClient(self.rated, {config.RATED_COLLECTION: self.rated})
+        self.helper.state_collection = FakeCollection()
+        self.helper.profile_collection = FakeCollection()
+        self.helper.tmdb_client = self.client(server)
+        self.calculator = ReccCalculator(metrics_sinks=[])
+        self.calculator.config.RECC_TOP_K = 0
+
+    def tick(self) -> datetime.datetime:
+        self.clock += datetime.timedelta(minutes=1)
+        return self.clock
+
+    def rate(self, media_id: int, rating: int, **details):
+        """
+        Function to rate a media, or change the rating of a media already rated
+        """
+        for media in self.rated.docs:
+            if media[self.id_key] == media_id:
+                media.update(rating=rating, updatedAt=self.tick())
+                return
+        media = {self.id_key: media_id, 'user_id': USER_ID, 'rating': rating, 'updatedAt': self.tick()}
+        media.update(details)
+        self.rated.docs.append(media)
+
+    async def full_recompute(self) -> tuple:
+        # Without the responses cached by the previous updates, so every request of a full recompute is counted
+        self.helper.tmdb_client.cache = ResponseCache(max_entries=1000, max_bytes=16 * 1024 * 1024, ttls={})
+        tmdb_data, error = await self.helper.gather_reccs_data(USER_ID)
+        self.assertIsNone(error)
+        return self.calculator.do_calculate(tmdb_data), tmdb_data
+
+    async def assert_incremental_matches_full(self):
+        requests = self.fake.requests
+        tmdb_data, error = await self.helper.gather_incremental_reccs_data(USER_ID)
+        self.assertIsNone(error)
+        self.assertIsNotNone(tmdb_data, "The change was not applied incrementally")
+        incremental_requests = self.fake.requests - requests
+        incremental = self.calculator.do_calculate(tmdb_data)
+        await self.helper.save_calc_state(USER_ID, tmdb_data)
+
+        requests = self.fake.requests
+        full, _ = await self.full_recompute()
+        self.assertLess(incremental_requests, self.fake.requests - requests)
+        self.assertEqual([(media[self.id_key], media['weight']) for media in incremental],
+                         [(media[self.id_key], media['weight']) for media in full])
+        self.assertEqual(incremental, full)
+
+    def top_rated(self) -> list:
+        ranked = sorted(self.rated.docs, key=lambda media: media['rating'], reverse=True)
+        return [media[self.id_key] for media in ranked]
+
+    async def test_incremental_updates_match_full_recompute(self):
+        _, tmdb_data = await self.full_recompute()
+        await self.helper.save_calc_state(USER_ID, tmdb_data)
+
+        with self.subTest(change='new top rated media'):
+            # A genre combination and director nobody else has, so the most common details stay the same
+            self.rate(900001, 10, director=900001, genres=[{'id': 37}], keywords=[])
+            await self.assert_incremental_matches_full()
+
+        with self.subTest(change='rating raised into the top rated'):
+            low = self.top_rated()[-1]
+            self.rate(low, 10)
+            await self.assert_incremental_matches_full()
+
+        with self.subTest(change='rating lowered out of the top rated'):
+            self.rate(self.top_rated()[0], 2)
+            await self.assert_incremental_matches_full()
+
+        with self.subTest(change='rating changed within the top rated'):
+            self.rate(self.top_rated()[3], 7)
+            await self.assert_incremental_matches_full()
+
+
+if __name__ == '__main__':
+    unittest.main()
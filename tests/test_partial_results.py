@@ -0,0 +1,124 @@
+"""
+Tests of the partial results mode of RecommendationsHelper.gather_sources
+
+The sources are requested from FakeTmdb instances: a healthy one, and one answering every request with a 500 for the
+sources that have to fail.
+
+    python -m unittest discover tests
+"""
+
+import unittest
+from base.recommendations_helper import RecommendationException, RecommendationsHelper
+from tests.test_tmdb_client import FakeTmdbTestCase
+
+
+class PartialResultsTest(FakeTmdbTestCase):
+
+    async def asyncSetUp(self):
+        self.helper = RecommendationsHelper()
+        self.top_media = [{self.helper.config.ID_KEY: media_id} for media_id in (1, 2)]
+        _, healthy = await self.serve()
+        _, failing = await self.serve(error_rate=1)
+        self.healthy = self.client(healthy)
+        self.failing = self.client(failing)
+
+    def requests(self, failing_sources: tuple = ()) -> dict:
+        """
+        The discover, similar and recommended requests of the top media, the failing_sources made against the failing
+        FakeTmdb
+        """
+        def client(source):
+            return self.failing if source in failing_sources else self.healthy
+
+        return {'discover_genres': client('discover_genres').make_parallel_discover_request(
+                    request_type='genre', unique_id_list=[('18', 3), ('80', 2)]),
+                'discover_keywords': client('discover_keywords').make_parallel_discover_request(
+                    request_type='keywords', unique_id_list=[(9715, 2)]),
+                'similar_movies': client('similar_movies').make_parallel_media_request(
+                    path='similar', medias=self.top_media),
+                'recommeded_movies': client('recommeded_movies').make_parallel_media_request(
+                    path='recommendations', medias=self.top_media)}
+
+    async def test_every_source_fetched(self):
+        collections, error = await self.helper.gather_sources(self.requests(), partial=True, medias=self.top_media)
+
+        self.assertIsNone(error)
+        self.assertEqual(collections['missing_sources'], [])
+        self.assertEqual(len(collections['discover_genres']), 40)
+        self.assertEqual(len(collections['similar_movies']), 40)
+        self.assertEqual(set(collections['media_results']), {'1', '2'})
+
+    async def test_failed_source_is_missing(self):
+        collections, error = await self.helper.gather_sources(self.requests(failing_sources=('discover_keywords',)),
+                                                              partial=True, medias=self.top_media)
+
+        self.assertIsNone(error)
+        self.assertEqual(collections['missing_sources'], ['discover_keywords'])
+        self.assertEqual(collections['discover_keywords'], [])
+        self.assertEqual(len(collections['discover_genres']), 40)
+        self.assertEqual(len(collections['recommeded_movies']), 40)
+
+    async def test_partially_failed_discover_source_is_missing(self):
+        # Only the first roll of seed 5 fails, so one of the four genre pages is missing
+        _, flaky = await self.serve(error_rate=0.7, seed=5)
+        flaky_client = self.client(flaky)
+        flaky_client.config.TMDB_DISCOVER_PAGES['genre'] = 2
+        requests = self.requests()
+        requests['discover_genres'].close()
+        requests['discover_genres'] = flaky_client.make_parallel_discover_request(
+            request_type='genre', unique_id_list=[('18', 3), ('80', 2)])
+
+        collections, error = await self.helper.gather_sources(requests, partial=True, medias=self.top_media)
+
+        self.assertIsNone(error)
+        self.assertEqual(collections['missing_sources'], ['discover_genres'])
+        # The pages that did arrive are still scored
+        self.assertEqual(len(collections['discover_genres']), 60)
+
+    async def test_partially_failed_media_source_is_missing(self):
+        requests = self.requests()
+        requests['similar_movies'].close()
+        requests['similar_movies'] = self.gather_media([(self.healthy, self.top_media[:1]),
+                                                        (self.failing, self.top_media[1:])])
+
+        collections, error = await self.helper.gather_sources(requests, partial=True, medias=self.top_media)
+
+        self.assertIsNone(error)
+        self.assertEqual(collections['missing_sources'], ['similar_movies'])
+        self.assertEqual(len(collections['similar_movies']), 20)
+        self.assertEqual(set(collections['media_results']['1']), {'similar_movies', 'recommeded_movies'})
+        self.assertEqual(set(collections['media_results']['2']), {'recommeded_movies'})
+
+    async def test_error_only_when_every_source_fails(self):
+        every_source = ('discover_genres', 'discover_keywords', 'similar_movies', 'recommeded_movies')
+
+        collections, error = await self.helper.gather_sources(self.requests(failing_sources=every_source[1:]),
+                                                              partial=True, medias=self.top_media)
+        self.assertIsNone(error)
+        self.assertEqual(collections['missing_sources'], list(every_source[1:]))
+
+        collections, error = await self.helper.gather_sources(self.requests(failing_sources=every_source),
+                                                              partial=True, medias=self.top_media)
+        self.assertIsNone(collections)
+        self.assertIs(error, RecommendationException)
+
+    async def test_any_failure_is_an_error_without_partial_mode(self):
+        collections, error = await self.helper.gather_sources(self.requests(failing_sources=('similar_movies',)),
+                                                              partial=False, medias=self.top_media)
+
+        self.assertIsNone(collections)
+        self.assertIs(error, RecommendationException)
+
+    async def gather_media(self, clients: list) -> tuple:
+        """
+        Function to request the similar media of each media from its own client, returned as one response
+        """
+        response = []
+        for client, medias in clients:
+            results, _ = await client.make_parallel_media_request(path='similar', medias=medias)
+            response.extend(results or [None] * len(medias))
+        return response, None
+
+
+if __name__ == '__main__':
+    unittest.main()
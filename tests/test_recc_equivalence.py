@@ -0,0 +1,204 @@
+"""
+Equivalence tests for the ReccCalculator scoring paths
+
+Every scoring path has to rank the discovered media exactly like the original nested loop implementation:
+the same media, in the same order, with the same weights. The original implementation is kept below as
+`reference_calculate` and compared with the indexed, vectorized, batch (do_calculate_many) and streaming paths on
+seeded synthetic workloads for movies and tv.
+
+    python -m unittest discover tests
+"""
+
+import asyncio
+import random
+import unittest
+from collections import Counter
+from base.recc_calculator import ReccCalculator
+from base.streaming_calculator import SOURCE_ORDER, StreamingReccCalculator
+from benchmarks.synthetic_data import make_tmdb_data
+
+SCENARIOS = [(num_ratings, overlap, pages, seed)
+             for seed, (num_ratings, overlap, pages) in enumerate([(10, 0.2, 1), (100, 0.5, 1), (100, 0.8, 2),
+                                                                   (1000, 0.2, 2), (1000, 0.8, 1), (50, 0.95, 1)])]
+
+
+def reference_calculate(tmdb_data: dict, id_key: str, info_key: str, tv: bool) -> list:
+    """
+    The original implementation of ReccCalculator.do_calculate
+    """
+    discovered_data = []
+    for source in ('discover_genres', 'discover_keywords', 'discover_directors', 'discover_networks',
+                   'similar_movies', 'recommeded_movies'):
+        discovered_data.extend(tmdb_data[source])
+
+    existing_ids = [item[id_key] for item in tmdb_data['rated_movies']]
+    for index in sorted([index for index, item in enumerate(discovered_data) if item['id'] in existing_ids],
+                        reverse=True):
+        del discovered_data[index]
+
+    media_weights = Counter([media['id'] for media in discovered_data])
+
+    # Remove duplicates, keeping the first occurrence
+    for key, value in media_weights.items():
+        occurrences = [index for index, item in enumerate(discovered_data) if value > 1 and item['id'] == key]
+        for index in sorted(occurrences, reverse=True)[:-1]:
+            del discovered_data[index]
+
+    genre_id_list = set()
+    for genre in tmdb_data['genres']:
+        genre_id_list.update(genre[0].split(','))
+    for movie in discovered_data:
+        for genre in movie['genre_ids']:
+            if str(genre) in genre_id_list:
+                for key in media_weights:
+                    if movie['id'] == key:
+                        media_weights[key] += 1
+
+    for movie in discovered_data:
+        for key in media_weights:
+            if movie['id'] == key:
+                media_weights[key] += round(movie['vote_average'], 3)
+
+    tags = [('director', 'directors')]
+    if tv:
+        tags.append(('networks', 'networks'))
+    tags.append(('keywords', 'keywords'))
+    for tag, detail in tags:
+        for movie in discovered_data:
+            if tag in movie:
+                for unique_id, count in tmdb_data[detail]:
+                    if movie[tag] == unique_id:
+                        media_weights[movie['id']] += count
+
+    sorted_weights = media_weights.most_common()
+    formatted_results = []
+    for media_key, value in sorted_weights:
+        formatted_media = {id_key: media_key, 'weight': round(100 / sorted_weights[0][1] * value)}
+        for media in discovered_data:
+            if media_key == media['id']:
+                formatted_media[info_key] = media
+                break
+        formatted_results.append(formatted_media)
+
+    return sorted(formatted_results, key=lambda k: k['weight'], reverse=True)
+
+
+def ranking(results: list, id_key: str, info_key: str) -> list:
+    """
+    The ranked media ids and weights and the display info of every result
+    """
+    return [(result[id_key], result['weight'], result[info_key]['title'], result[info_key]['poster_path'])
+            for result in results]
+
+
+def stream_batches(tmdb_data: dict, rng: random.Random, page_size: int = 20) -> list:
+    """
+    Split the sources into (source, index, results) batches, one per page, the way stream_reccs_data yields them
+    """
+    batches = []
+    for source in SOURCE_ORDER:
+        results = tmdb_data[source]
+        for index, start in enumerate(range(0, len(results), page_size)):
+            batches.append((source, index, results[start:start + page_size]))
+    # Responses arrive in any order
+    rng.shuffle(batches)
+    return batches
+
+
+async def replay(batches: list):
+    for batch in batches:
+        yield batch
+
+
+class ReccEquivalenceTest(unittest.TestCase):
+
+    # tv -> [(scenario, tmdb_data, expected ranking)], the reference implementation is slow
+    expected = {}
+
+    def calculator(self, calculator_class=ReccCalculator, tv: bool = False, mode: str = 'indexed'):
+        calculator = calculator_class(metrics_sinks=[])
+        calculator.config.NODE_ENV = 'tv' if tv else 'movie'
+        if tv:
+            calculator.config.load_tv_configs()
+        else:
+            calculator.config.load_movie_configs()
+        calculator.config.RECC_SCORING_MODE = mode
+        calculator.config.RECC_TOP_K = 0
+        return calculator
+
+    def workloads(self, tv: bool) -> list:
+        if tv not in self.expected:
+            config = self.calculator(tv=tv).config
+            workloads = []
+            for num_ratings, overlap, pages, seed in SCENARIOS:
+                tmdb_data = make_tmdb_data(num_ratings=num_ratings, overlap=overlap, id_key=config.ID_KEY, tv=tv,
+                                           seed=seed, pages=pages)
+                expected = reference_calculate(tmdb_data, id_key=config.ID_KEY,
+                                               info_key=config.INFO_KEY, tv=tv)
+                workloads.append(((num_ratings, overlap, pages, seed), tmdb_data,
+                                  ranking(expected, config.ID_KEY, config.INFO_KEY)))
+            self.expected[tv] = workloads
+        return self.expected[tv]
+
+    def test_do_calculate(self):
+        for tv in (False, True):
+            for mode in ('indexed', 'vectorized'):
+                calculator = self.calculator(tv=tv, mode=mode)
+                config = calculator.config
+                for scenario, tmdb_data, expected in self.workloads(tv):
+                    with self.subTest(tv=tv, mode=mode, scenario=scenario):
+                        results = calculator.do_calculate(tmdb_data)
+                        self.assertEqual(ranking(results, config.ID_KEY, config.INFO_KEY), expected)
+
+    def test_do_calculate_many(self):
+        for tv in (False, True):
+            calculator = self.calculator(tv=tv)
+            config = calculator.config
+            workloads = self.workloads(tv)
+            batch = calculator.do_calculate_many([tmdb_data for _, tmdb_data, _ in workloads])
+            for (scenario, _, expected), results in zip(workloads, batch):
+                with self.subTest(tv=tv, scenario=scenario):
+                    self.assertEqual(ranking(results, config.ID_KEY, config.INFO_KEY), expected)
+
+    def test_calculate_stream(self):
+        for tv in (False, True):
+            calculator = self.calculator(StreamingReccCalculator, tv=tv)
+            config = calculator.config
+            for scenario, tmdb_data, expected in self.workloads(tv):
+                with self.subTest(tv=tv, scenario=scenario):
+                    batches = stream_batches(tmdb_data, random.Random(scenario[-1]))
+                    results, _ = asyncio.run(calculator.calculate_stream(tmdb_data=tmdb_data,
+                                                                         batches=replay(batches)))
+                    self.assertEqual(ranking(results, config.ID_KEY, config.INFO_KEY), expected)
+
+    def test_input_is_kept(self):
+        calculator = self.calculator()
+        config = calculator.config
+        scenario, tmdb_data, expected = self.workloads(tv=False)[1]
+        sources = {source: list(tmdb_data[source]) for source in SOURCE_ORDER}
+        for release_input in (False, True):
+            with self.subTest(release_input=release_input):
+                workload = dict(tmdb_data, **{source: list(results) for source, results in sources.items()})
+                results = calculator.do_calculate(workload, release_input=release_input)
+                self.assertEqual(ranking(results, config.ID_KEY, config.INFO_KEY), expected)
+                if release_input:
+                    self.assertEqual({source: workload[source] for source in SOURCE_ORDER},
+                                     {source: [] for source in SOURCE_ORDER})
+                else:
+                    self.assertEqual({source: workload[source] for source in SOURCE_ORDER}, sources)
+                    # A second run over the same input ranks the same media
+                    results = calculator.do_calculate(workload)
+                    self.assertEqual(ranking(results, config.ID_KEY, config.INFO_KEY), expected)
+
+    def test_top_k(self):
+        calculator = self.calculator()
+        calculator.config.RECC_TOP_K = 25
+        config = calculator.config
+        for scenario, tmdb_data, expected in self.workloads(tv=False):
+            with self.subTest(scenario=scenario):
+                results = calculator.do_calculate(tmdb_data)
+                self.assertEqual(ranking(results, config.ID_KEY, config.INFO_KEY), expected[:25])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,143 @@
+"""
+Tests of the TasteProfile and of how RecommendationsHelper.load_taste_profile keeps it up to date
+
+The rated media and the stored profiles live in in-memory collections. After every change to the ratings the loaded
+profile has to equal a profile built from scratch from every rated media.
+
+    python -m unittest discover tests
+"""
+
+import datetime
+import random
+import unittest
+from collections import Counter
+from base.recommendations_helper import RecommendationsHelper
+from base.taste_profile import TasteProfile
+from benchmarks.synthetic_data import make_rated_media
+from tests.test_incremental_recommendations import FakeCollection, FakeMongoClient
+
+USER_ID = 'benchmark'
+
+
+def media(media_id: int, rating: int, director: int, genres: list, keywords: list, updated_at=None) -> dict:
+    return {'movie_id': media_id, 'rating': rating, 'director': director, 'genres': [{'id': genre} for genre in genres],
+            'keywords': [{'id': keyword} for keyword in keywords], 'updatedAt': updated_at}
+
+
+class TasteProfileTest(unittest.TestCase):
+
+    def test_apply_counts_a_new_media(self):
+        profile = TasteProfile(user_id=USER_ID)
+        profile.apply(media(1, 8, director=10, genres=[18, 80], keywords=[5, 6], updated_at=1), 'movie_id')
+        profile.apply(media(2, 4, director=10, genres=[18], keywords=[6], updated_at=2), 'movie_id')
+
+        self.assertEqual(profile.directors, Counter({10: 2}))
+        self.assertEqual(profile.genres, Counter({'18,80': 1, '18': 1}))
+        self.assertEqual(profile.keywords, Counter({5: 1, 6: 2}))
+        self.assertEqual(profile.ratings, {1: 8, 2: 4})
+        self.assertEqual(profile.synced_at, 2)
+
+    def test_apply_a_changed_rating(self):
+        profile = TasteProfile(user_id=USER_ID)
+        profile.apply(media(1, 8, director=10, genres=[18], keywords=[5], updated_at=1), 'movie_id')
+        profile.apply(media(2, 4, director=11, genres=[35], keywords=[], updated_at=2), 'movie_id')
+        profile.apply(media(1, 3, director=10, genres=[18], keywords=[5], updated_at=3), 'movie_id')
+
+        # The details are only counted once, the rating keeps its place in the order the media were rated
+        self.assertEqual(profile.directors, Counter({10: 1, 11: 1}))
+        self.assertEqual(profile.keywords, Counter({5: 1}))
+        self.assertEqual(list(profile.ratings.items()), [(1, 3), (2, 4)])
+        self.assertEqual(profile.synced_at, 3)
+
+    def test_deconstruct_round_trip(self):
+        profile = TasteProfile(user_id=USER_ID)
+        profile.apply(media(1, 8, director=10, genres=[18, 80], keywords=[5, 6], updated_at=1), 'movie_id')
+
+        restored = TasteProfile.reconstruct(profile.deconstruct())
+
+        self.assertEqual(restored.counters(), profile.counters())
+        self.assertEqual(restored.ratings, profile.ratings)
+        self.assertEqual(restored.synced_at, profile.synced_at)
+
+
+class LoadTasteProfileTest(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.helper = RecommendationsHelper()
+        config = self.helper.config
+        self.id_key = config.ID_KEY
+        self.clock = datetime.datetime(2024, 1, 1)
+        rng = random.Random(3)
+        rated = []
+        for media_id in rng.sample(range(1, 5000), 40):
+            rated_media = make_rated_media(rng, media_id, self.id_key, tv=config.NODE_ENV == 'tv')
+            rated_media.update(user_id=USER_ID, updatedAt=self.tick())
+            rated.append(rated_media)
+        self.rated = FakeCollection(rated)
+        self.helper.mongo_client = FakeMongoClient(self.rated, {config.RATED_COLLECTION: self.rated})
+        self.helper.profile_collection = FakeCollection()
+
+    def tick(self) -> datetime.datetime:
+        self.clock += datetime.timedelta(minutes=1)
+        return self.clock
+
+    async def assert_profile_is_current(self) -> TasteProfile:
+        profile, error = await self.helper.load_taste_profile(USER_ID)
+        self.assertIsNone(error)
+
+        expected = TasteProfile(user_id=USER_ID)
+        for rated_media in self.rated.docs:
+            expected.apply(rated_media, self.id_key)
+        self.assertEqual(profile.counters(), expected.counters())
+        self.assertEqual(profile.ratings, expected.ratings)
+        self.assertEqual(profile.synced_at, expected.synced_at)
+
+        stored = await self.helper.profile_collection.find_one({'user_id': USER_ID})
+        self.assertEqual(stored, profile.deconstruct())
+        return profile
+
+    async def test_profile_is_built_from_every_rated_media(self):
+        self.assertEqual(self.helper.profile_collection.docs, [])
+
+        profile = await self.assert_profile_is_current()
+
+        self.assertEqual(len(profile.ratings), 40)
+
+    async def test_added_rating_is_applied(self):
+        await self.assert_profile_is_current()
+        rated_media = make_rated_media(random.Random(0), 90001, self.id_key, tv=self.helper.config.NODE_ENV == 'tv')
+        rated_media.update(user_id=USER_ID, updatedAt=self.tick())
+        self.rated.docs.append(rated_media)
+
+        profile = await self.assert_profile_is_current()
+
+        self.assertEqual(profile.ratings[90001], rated_media['rating'])
+
+    async def test_changed_rating_is_applied(self):
+        await self.assert_profile_is_current()
+        changed = self.rated.docs[5]
+        changed.update(rating=11 - changed['rating'], updatedAt=self.tick())
+
+        profile = await self.assert_profile_is_current()
+
+        self.assertEqual(profile.ratings[changed[self.id_key]], changed['rating'])
+
+    async def test_profile_is_rebuilt_after_a_removal(self):
+        await self.assert_profile_is_current()
+        removed = self.rated.docs.pop(7)
+
+        profile = await self.assert_profile_is_current()
+
+        self.assertNotIn(removed[self.id_key], profile.ratings)
+
+    async def test_unchanged_profile_is_not_stored_again(self):
+        await self.assert_profile_is_current()
+        stored = self.helper.profile_collection.docs[0]
+
+        await self.assert_profile_is_current()
+
+        self.assertIs(self.helper.profile_collection.docs[0], stored)
+
+
+if __name__ == '__main__':
+    unittest.main()
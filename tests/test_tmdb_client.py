@@ -0,0 +1,267 @@
+"""
+Tests of the TmdbClient request path against a local FakeTmdb
+
+Every test starts a FakeTmdb on a random port and points a TmdbClient at it. The client gets its own response cache,
+rate limiter and latency tracker so the process wide ones of other tests do not leak in, and FakeTmdb.requests
+counts what actually reached the API.
+
+    python -m unittest discover tests
+"""
+
+import asyncio
+import time
+import unittest
+from aiohttp.test_utils import TestServer
+from base.latency import LatencyTracker
+from base.rate_limiter import RateLimiter
+from base.response_cache import ResponseCache, normalize_url
+from base.tmdbclient import TmdbClient, close_session, in_flight
+from benchmarks.fake_tmdb import FakeTmdb, make_latency
+
+
+class FakeTmdbTestCase(unittest.IsolatedAsyncioTestCase):
+
+    async def start(self, retries: int = 0, **options) -> TmdbClient:
+        """
+        Function to start a FakeTmdb with the given options and get a client pointed at it
+        """
+        self.fake, self.server = await self.serve(**options)
+        return self.client(self.server, retries=retries)
+
+    async def serve(self, **options) -> tuple:
+        options.setdefault('seed', 0)
+        fake = FakeTmdb(**options)
+        server = TestServer(fake.app())
+        await server.start_server()
+        self.addAsyncCleanup(server.close)
+        self.addAsyncCleanup(close_session)
+        return fake, server
+
+    @staticmethod
+    def client(server: TestServer, retries: int = 0) -> TmdbClient:
+        client = TmdbClient()
+        # Same format as TMDB_API_URL
+        client.api_endpoint = str(server.make_url('/3/'))
+        client.cache = ResponseCache(max_entries=100, max_bytes=1024 * 1024, ttls={})
+        client.limiter = RateLimiter(rate=0, burst=1, max_concurrency=50)
+        client.latency = LatencyTracker(percentile=0)
+        client.config.TMDB_MAX_RETRIES = retries
+        client.config.TMDB_RETRY_BASE_SECONDS = 0.01
+        return client
+
+    def url(self, client: TmdbClient, path: str) -> str:
+        return f"{client.api_endpoint}{path}"
+
+
+class SingleFlightTest(FakeTmdbTestCase):
+
+    async def test_concurrent_callers_share_one_request(self):
+        client = await self.start(latency='fixed:0.1')
+        urls = [self.url(client, 'discover/movie?with_genres=18&page=1'),
+                self.url(client, 'discover/movie?page=1&with_genres=18'),
+                self.url(client, '/discover/movie?with_genres=18&page=1')]
+
+        results = await asyncio.gather(*[client.fetch(urls[index % len(urls)]) for index in range(10)])
+
+        self.assertEqual(self.fake.requests, 1)
+        self.assertEqual({status for _, status in results}, {200})
+        self.assertEqual(len({body for body, _ in results}), 1)
+        self.assertEqual(in_flight[asyncio.get_running_loop()], {})
+
+    async def test_urls_in_flight_are_requested_once_each(self):
+        client = await self.start(latency='fixed:0.05')
+        urls = [self.url(client, f"movie/{media_id}") for media_id in (1, 2, 3)]
+
+        results = await asyncio.gather(*[client.fetch(url) for url in urls * 4])
+
+        self.assertEqual(self.fake.requests, 3)
+        self.assertEqual([status for _, status in results], [200] * 12)
+
+    async def test_later_callers_request_again(self):
+        client = await self.start()
+        url = self.url(client, 'movie/1')
+
+        await client.fetch(url)
+        await client.fetch(url)
+
+        self.assertEqual(self.fake.requests, 2)
+
+    async def test_error_response_reaches_every_waiter(self):
+        client = await self.start(retries=1, latency='fixed:0.05', error_rate=1)
+        url = self.url(client, 'movie/1')
+
+        results = await asyncio.gather(*[client.fetch(url) for _ in range(5)])
+
+        # One request and its retry, shared by every waiter
+        self.assertEqual(self.fake.requests, 2)
+        self.assertEqual({status for _, status in results}, {500})
+
+    async def test_connection_error_reaches_every_waiter(self):
+        client = await self.start()
+        port = self.server.port
+        await self.server.close()
+        url = f"http://127.0.0.1:{port}/3/movie/1"
+
+        results = await asyncio.gather(*[client.fetch(url) for _ in range(5)])
+
+        self.assertEqual(results, [(None, None)] * 5)
+        self.assertEqual(in_flight[asyncio.get_running_loop()], {})
+
+    async def test_cancelling_a_waiter_keeps_the_shared_request(self):
+        client = await self.start(latency='fixed:0.2')
+        url = self.url(client, 'movie/1')
+        waiters = [asyncio.ensure_future(client.fetch(url)) for _ in range(3)]
+        await asyncio.sleep(0.05)
+
+        waiters[0].cancel()
+        results = await asyncio.gather(*waiters, return_exceptions=True)
+
+        self.assertIsInstance(results[0], asyncio.CancelledError)
+        self.assertEqual([status for _, status in results[1:]], [200, 200])
+        self.assertEqual(self.fake.requests, 1)
+
+    async def test_cancelling_every_waiter_keeps_the_request_running(self):
+        client = await self.start(latency='fixed:0.1')
+        url = self.url(client, 'movie/1')
+        waiter = asyncio.ensure_future(client.fetch(url))
+        await asyncio.sleep(0.02)
+        flight = in_flight[asyncio.get_running_loop()][normalize_url(url)]
+
+        waiter.cancel()
+        body, status = await flight
+
+        self.assertEqual(status, 200)
+        # The finished request filled the cache for the next caller
+        self.assertEqual(client.cache.get(url), body)
+
+
+
+class ThrottlingTest(FakeTmdbTestCase):
+
+    async def test_throttled_request_is_retried_after_retry_after(self):
+        # The first roll of seed 1 is throttled, the second is not
+        client = await self.start(retries=2, throttle_rate=0.5, retry_after=0.2, seed=1)
+
+        start = time.monotonic()
+        _, status = await client.fetch(self.url(client, 'movie/1'))
+
+        self.assertEqual(status, 200)
+        self.assertEqual(self.fake.requests, 2)
+        self.assertGreaterEqual(time.monotonic() - start, 0.2)
+
+    async def test_retries_give_up_with_the_last_response(self):
+        client = await self.start(retries=2, throttle_rate=1, retry_after=0.05)
+
+        _, status = await client.fetch(self.url(client, 'movie/1'))
+
+        self.assertEqual(status, 429)
+        self.assertEqual(self.fake.requests, 3)
+
+    async def test_retry_after_holds_every_new_request(self):
+        client = await self.start(throttle_rate=1, retry_after=0.3)
+        _, status = await client.fetch(self.url(client, 'movie/1'))
+        self.assertEqual(status, 429)
+
+        start = time.monotonic()
+        await client.fetch(self.url(client, 'movie/2'))
+
+        # Another url, but it is only sent once the Retry-After of the first response has passed
+        self.assertGreaterEqual(time.monotonic() - start, 0.25)
+        self.assertEqual(self.fake.requests, 2)
+
+    async def test_throttled_url_is_none_in_its_batch(self):
+        # Only the first roll of seed 5 is throttled
+        client = await self.start(throttle_rate=0.7, retry_after=0.01, seed=5)
+        medias = [{client.config.ID_KEY: media_id} for media_id in (1, 2, 3, 4)]
+
+        results, error = await client.make_parallel_media_request(medias, 'similar')
+
+        self.assertIsNone(error)
+        self.assertEqual(len(results), 4)
+        self.assertEqual(sum(result is None for result in results), 1)
+        for result in results:
+            if result is not None:
+                self.assertEqual(len(result['results']), 20)
+
+    async def test_batch_fails_when_every_url_is_throttled(self):
+        client = await self.start(throttle_rate=1, retry_after=0.01)
+        medias = [{client.config.ID_KEY: media_id} for media_id in (1, 2)]
+
+        results, error = await client.make_parallel_media_request(medias, 'similar')
+
+        self.assertIsNone(results)
+        self.assertIsNotNone(error)
+
+
+
+class DeadlineTest(FakeTmdbTestCase):
+
+    async def test_pending_urls_fail_at_the_deadline(self):
+        client = await self.start(latency='fixed:0.3')
+        client.config.TMDB_FANOUT_DEADLINE_SECONDS = 0.1
+        urls = [self.url(client, f"movie/{media_id}") for media_id in (1, 2, 3)]
+
+        start = time.monotonic()
+        results = await client.fetch_all(urls)
+
+        self.assertLess(time.monotonic() - start, 0.25)
+        self.assertEqual(results, [(None, None)] * 3)
+
+    async def test_answered_urls_are_kept_at_the_deadline(self):
+        client = await self.start(latency='fixed:0.3')
+        client.config.TMDB_FANOUT_DEADLINE_SECONDS = 0.1
+        cached = self.url(client, 'movie/1')
+        client.cache.put(cached, b'{"id": 1}')
+        pending = self.url(client, 'movie/2')
+
+        bodies = await client.get_many([cached, pending])
+
+        self.assertEqual(bodies, [b'{"id": 1}', None])
+
+    async def test_missed_requests_still_fill_the_cache(self):
+        client = await self.start(latency='fixed:0.2')
+        client.config.TMDB_FANOUT_DEADLINE_SECONDS = 0.05
+        url = self.url(client, 'movie/1')
+
+        self.assertEqual(await client.fetch_all([url]), [(None, None)])
+        await asyncio.sleep(0.3)
+
+        self.assertIsNotNone(client.cache.get(url))
+        self.assertEqual(self.fake.requests, 1)
+
+
+class HedgingTest(FakeTmdbTestCase):
+
+    async def start_hedged(self, latencies: list) -> TmdbClient:
+        """
+        Function to get a client that hedges after 50 ms, against a FakeTmdb answering its requests with the given
+        latencies in turn
+        """
+        client = await self.start()
+        client.latency = LatencyTracker(percentile=50, min_samples=1)
+        client.latency.observe(0.05)
+        latencies = [make_latency(spec) for spec in latencies]
+        self.fake.latency = lambda: latencies.pop(0)()
+        return client
+
+    async def test_hedged_duplicate_wins(self):
+        client = await self.start_hedged(['fixed:1', 'fixed:0'])
+
+        start = time.monotonic()
+        _, status = await client.fetch(self.url(client, 'movie/1'))
+
+        self.assertEqual(status, 200)
+        self.assertLess(time.monotonic() - start, 0.5)
+        self.assertEqual(self.fake.requests, 2)
+
+    async def test_fast_request_is_not_hedged(self):
+        client = await self.start_hedged(['fixed:0'])
+
+        _, status = await client.fetch(self.url(client, 'movie/1'))
+
+        self.assertEqual(status, 200)
+        self.assertEqual(self.fake.requests, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
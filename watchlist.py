@@ -11,7 +11,7 @@ class Watchlist:
     def __init__(self) -> None:
         self.config = Config()
         self.mongo_client = MongoClient()
-        self.tmdb_client = TmdbClient()
+        self.tmdb_client = TmdbClient(mongo_client=self.mongo_client)
         self.rabbitmq_client = RabbitMqClient()
 
     async def process_watchlist(self, media_list: list) -> Tuple[Optional[list], Optional[Exception]]: